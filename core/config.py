@@ -8,11 +8,67 @@ DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR / "Data"))
 UPLOADS_DIR = Path(os.getenv("UPLOADS_DIR", BASE_DIR / "uploads"))
 LANCE_DB_PATH = Path(os.getenv("LANCE_DB_PATH", BASE_DIR / "lancedb"))
 SQLITE_PATH = Path(os.getenv("SQLITE_PATH", BASE_DIR / "app.db"))
+# CSV bulk-load files; NEO4J_IMPORT_URL is how the Neo4j server sees the same directory.
+GRAPH_EXPORT_DIR = Path(os.getenv("GRAPH_EXPORT_DIR", BASE_DIR / "graph_import"))
+NEO4J_IMPORT_URL = os.getenv("NEO4J_IMPORT_URL", "file:///")
+# "neo4j" or "memory" (in-process snapshot of the waiver graph at GRAPH_MEMORY_PATH)
+GRAPH_BACKEND = os.getenv("GRAPH_BACKEND", "neo4j")
+GRAPH_MEMORY_PATH = Path(os.getenv("GRAPH_MEMORY_PATH", BASE_DIR / "graph_memory.npz"))
+GRAPH_MATRIX_PATH = Path(os.getenv("GRAPH_MATRIX_PATH", BASE_DIR / "graph_matrix.npz"))
+CHUNK_CODEC = os.getenv("CHUNK_CODEC", "zlib")  # "zlib" or "zstd" (needs zstandard)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+SQLITE_WRITE_BATCH = int(os.getenv("SQLITE_WRITE_BATCH", "256"))
+# Longest a caller waits for its write to be committed before giving up.
+SQLITE_WRITE_TIMEOUT_S = float(os.getenv("SQLITE_WRITE_TIMEOUT_S", "300"))
+
+# LanceDB ANN indexing: build once a table has this many rows; retrain when the
+# unindexed share passes the fraction (smaller appends are folded in by optimize()).
+LANCE_INDEX_MIN_ROWS = int(os.getenv("LANCE_INDEX_MIN_ROWS", "10000"))
+LANCE_INDEX_REBUILD_FRACTION = float(os.getenv("LANCE_INDEX_REBUILD_FRACTION", "0.2"))
+LANCE_INDEX_TYPE = os.getenv("LANCE_INDEX_TYPE", "IVF_PQ")  # or IVF_HNSW_SQ
+LANCE_NPROBES = int(os.getenv("LANCE_NPROBES", "20"))
+LANCE_REFINE_FACTOR = int(os.getenv("LANCE_REFINE_FACTOR", "0")) or None
+# Compact vector copy for flat search: "none", "float16" or "int8" codes, optionally
+# PCA-reduced; the top k * VECTOR_COMPACT_RESCORE candidates are re-ranked on float32.
+# Only used on tables without an ANN index, and never when nprobes/refine_factor are passed.
+# It speeds up flat search but adds disk: the float32 vectors are kept for rescoring.
+VECTOR_COMPACT_DTYPE = os.getenv("VECTOR_COMPACT_DTYPE", "none")
+VECTOR_COMPACT_PCA_DIMS = int(os.getenv("VECTOR_COMPACT_PCA_DIMS", "0"))
+VECTOR_COMPACT_RESCORE = int(os.getenv("VECTOR_COMPACT_RESCORE", "4"))
+VECTOR_COMPACT_DIR = Path(os.getenv("VECTOR_COMPACT_DIR", LANCE_DB_PATH / "compact"))
+# Text RAG retrieval: "hybrid" (BM25 + vector, fused with RRF), "vector" or "fts".
+TEXT_SEARCH_MODE = os.getenv("TEXT_SEARCH_MODE", "hybrid")
+TEXT_HYBRID_VECTOR_WEIGHT = float(os.getenv("TEXT_HYBRID_VECTOR_WEIGHT", "0.5"))
+TEXT_HYBRID_CANDIDATES = int(os.getenv("TEXT_HYBRID_CANDIDATES", "4"))  # per side, times k
+TEXT_RRF_K = int(os.getenv("TEXT_RRF_K", "60"))
+# Query-embedding LRU (entries); EMBED_CACHE_DISK=1 also keeps vectors in app.db across restarts.
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "1024"))
+EMBED_CACHE_DISK = os.getenv("EMBED_CACHE_DISK", "0") == "1"
+# Texts per embedding request / query vectors per LanceDB search in batch RAG coding.
+KB_RETRIEVAL_BATCH = int(os.getenv("KB_RETRIEVAL_BATCH", "64"))
 
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "abhishek")
 NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "neo4j")
+GRAPH_MAX_ROWS = int(os.getenv("GRAPH_MAX_ROWS", "200"))
+GRAPH_FETCH_SIZE = int(os.getenv("GRAPH_FETCH_SIZE", "100"))
+GRAPH_CONTEXT_TOKENS = int(os.getenv("GRAPH_CONTEXT_TOKENS", "6000"))
+GRAPH_MAX_ESTIMATED_ROWS = int(os.getenv("GRAPH_MAX_ESTIMATED_ROWS", "100000"))
+# Neighbours per waiver in the precomputed SIMILAR_TO graph.
+GRAPH_SIMILAR_K = int(os.getenv("GRAPH_SIMILAR_K", "10"))
+GRAPH_PREFETCH = os.getenv("GRAPH_PREFETCH", "1") == "1"
+GRAPH_PLAN_CACHE = os.getenv("GRAPH_PLAN_CACHE", "1") == "1"
+# Cosine similarity above which a cached plan is reused for a reworded question (only plans
+# without state/year or other literals); unset = exact only.
+GRAPH_PLAN_CACHE_SIMILARITY = (
+    float(os.getenv("GRAPH_PLAN_CACHE_SIMILARITY")) if os.getenv("GRAPH_PLAN_CACHE_SIMILARITY") else None
+)
+GRAPH_FORBIDDEN_OPERATORS = [
+    op.strip()
+    for op in os.getenv("GRAPH_FORBIDDEN_OPERATORS", "AllNodesScan,CartesianProduct").split(",")
+    if op.strip()
+]
 
 AI_PROVIDER = os.getenv("AI_PROVIDER", "OLLAMA")
 OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "bge-m3")
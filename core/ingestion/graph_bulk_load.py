@@ -0,0 +1,336 @@
+"""CSV bulk-load path for first loads of large statewise spreadsheets.
+
+`export_statewise_csv` writes node and relationship CSVs (embeddings
+included) with neo4j-admin headers, e.g. `applicationNumber:ID(WaiverApplication)`
+and `embedding:float[]`. The same files feed both loaders:
+
+* `neo4j-admin database import full` (offline, fastest; the database must
+  be stopped) via `admin_import_command` / `run_bulk_load(method="admin")`.
+* `LOAD CSV` over Bolt in batched transactions (`method="load_csv"`); the
+  files must be in Neo4j's import directory, addressed by NEO4J_IMPORT_URL.
+
+Both produce the same graph as `ingest_statewise_kg`.
+"""
+import csv
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import pandas as pd
+from neo4j import GraphDatabase
+
+from core import config
+from core.ingestion.graph_ingest import (
+    _batch_params,
+    _delete_in_batches,
+    _embedding_model_tag,
+    _get_provider_config,
+    _prepare_rows,
+    ingest_statewise_kg,
+)
+from core.ingestion.waiver_similarity import build_similarity_edges
+from core.rag.graph_backend import refresh_memory_snapshot
+from core.storage.graph_schema import ensure_graph_schema
+
+ARRAY_DELIMITER = ";"
+_COUNTRY = "United States"
+_LOAD_BATCH = 10000
+
+# file name -> header; node files first, relationship files after.
+NODE_FILES = {
+    "countries.csv": ["name:ID(Country)", ":LABEL"],
+    "states.csv": ["name:ID(State)", ":LABEL"],
+    "questions.csv": ["name:ID(Question)", ":LABEL"],
+    "themes.csv": ["key:ID(Theme)", "name", "value", "embedding:float[]", "embeddingModel", ":LABEL"],
+    "waivers.csv": [
+        "applicationNumber:ID(WaiverApplication)",
+        "programTitle",
+        "year",
+        "approvedDate",
+        "applicationType",
+        "stateName",
+        "contentHash",
+        "themeSummary",
+        "embedding:float[]",
+        ":LABEL",
+    ],
+}
+RELATIONSHIP_FILES = {
+    "state_located_in.csv": [":START_ID(State)", ":END_ID(Country)", ":TYPE"],
+    "country_has_state.csv": [":START_ID(Country)", ":END_ID(State)", ":TYPE"],
+    "state_has_application.csv": [":START_ID(State)", ":END_ID(WaiverApplication)", ":TYPE"],
+    "waiver_submitted_by.csv": [":START_ID(WaiverApplication)", ":END_ID(State)", ":TYPE"],
+    "waiver_has_theme.csv": [":START_ID(WaiverApplication)", ":END_ID(Theme)", ":TYPE"],
+    "theme_answers.csv": [":START_ID(Theme)", ":END_ID(Question)", ":TYPE"],
+}
+
+# LOAD CSV statements per file, in load order. Nodes are CREATEd (the
+# database is cleared first); relationships MATCH their endpoints through
+# the uniqueness constraints created beforehand.
+_EMBEDDING = (
+    "CASE row.`embedding:float[]` WHEN '' THEN null "
+    f"ELSE [x IN split(row.`embedding:float[]`, '{ARRAY_DELIMITER}') | toFloat(x)] END"
+)
+_LOAD_STATEMENTS = {
+    "countries.csv": "CREATE (:Country {name: row.`name:ID(Country)`})",
+    "states.csv": "CREATE (:State {name: row.`name:ID(State)`})",
+    "questions.csv": "CREATE (:Question {name: row.`name:ID(Question)`})",
+    "themes.csv": f"""
+        CREATE (:Theme {{key: row.`key:ID(Theme)`, name: row.name, value: row.value,
+                        embedding: {_EMBEDDING}, embeddingModel: row.embeddingModel}})
+    """,
+    "waivers.csv": f"""
+        CREATE (:WaiverApplication {{
+            applicationNumber: row.`applicationNumber:ID(WaiverApplication)`,
+            programTitle: row.programTitle, year: row.year, approvedDate: row.approvedDate,
+            applicationType: row.applicationType, stateName: row.stateName,
+            contentHash: row.contentHash, themeSummary: row.themeSummary,
+            embedding: {_EMBEDDING}
+        }})
+    """,
+    "state_located_in.csv": """
+        MATCH (a:State {name: row.`:START_ID(State)`}), (b:Country {name: row.`:END_ID(Country)`})
+        CREATE (a)-[:LOCATED_IN]->(b)
+    """,
+    "country_has_state.csv": """
+        MATCH (a:Country {name: row.`:START_ID(Country)`}), (b:State {name: row.`:END_ID(State)`})
+        CREATE (a)-[:HAS_STATE]->(b)
+    """,
+    "state_has_application.csv": """
+        MATCH (a:State {name: row.`:START_ID(State)`}),
+              (b:WaiverApplication {applicationNumber: row.`:END_ID(WaiverApplication)`})
+        CREATE (a)-[:HAS_APPLICATION]->(b)
+    """,
+    "waiver_submitted_by.csv": """
+        MATCH (a:WaiverApplication {applicationNumber: row.`:START_ID(WaiverApplication)`}),
+              (b:State {name: row.`:END_ID(State)`})
+        CREATE (a)-[:SUBMITTED_BY]->(b)
+    """,
+    "waiver_has_theme.csv": """
+        MATCH (a:WaiverApplication {applicationNumber: row.`:START_ID(WaiverApplication)`}),
+              (b:Theme {key: row.`:END_ID(Theme)`})
+        CREATE (a)-[:HAS_THEME]->(b)
+    """,
+    "theme_answers.csv": """
+        MATCH (a:Theme {key: row.`:START_ID(Theme)`}), (b:Question {name: row.`:END_ID(Question)`})
+        CREATE (a)-[:ANSWERS]->(b)
+    """,
+}
+
+
+def _vector(values) -> str:
+    return ARRAY_DELIMITER.join(repr(float(v)) for v in values) if values else ""
+
+
+def export_statewise_csv(
+    file_path: str,
+    out_dir: Optional[Path] = None,
+    provider: str = "ollama",
+    on_progress: Optional[Callable[[dict], None]] = None,
+    batch_size: int = 500,
+) -> dict:
+    """Embed the spreadsheet and write neo4j-admin style CSVs into `out_dir`."""
+    out_dir = Path(out_dir or config.GRAPH_EXPORT_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    provider = provider.lower()
+    embedder, dims = _get_provider_config(provider)
+    model_tag = _embedding_model_tag(provider)
+
+    df = pd.read_excel(file_path, dtype=str).fillna("")
+    rows = _prepare_rows(df, model_tag)
+
+    start = time.perf_counter()
+    handles = {
+        name: open(out_dir / name, "w", newline="", encoding="utf-8")
+        for name in {**NODE_FILES, **RELATIONSHIP_FILES}
+    }
+    try:
+        writers = {name: csv.writer(handle) for name, handle in handles.items()}
+        for name, header in {**NODE_FILES, **RELATIONSHIP_FILES}.items():
+            writers[name].writerow(header)
+
+        writers["countries.csv"].writerow([_COUNTRY, "Country"])
+        states, questions, seen_themes = set(), set(), set()
+        counts = {"waivers": 0, "themes": 0}
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            row_params, theme_params = _batch_params(embedder, batch, seen_themes)
+            for theme in theme_params:
+                writers["themes.csv"].writerow(
+                    [theme["key"], theme["name"], theme["value"], _vector(theme["embedding"]), model_tag, "Theme"]
+                )
+                writers["theme_answers.csv"].writerow([theme["key"], theme["name"], "ANSWERS"])
+                if theme["name"] not in questions:
+                    questions.add(theme["name"])
+                    writers["questions.csv"].writerow([theme["name"], "Question"])
+            for row in row_params:
+                state, waiver = row["state"], row["application_number"]
+                if state not in states:
+                    states.add(state)
+                    writers["states.csv"].writerow([state, "State"])
+                    writers["state_located_in.csv"].writerow([state, _COUNTRY, "LOCATED_IN"])
+                    writers["country_has_state.csv"].writerow([_COUNTRY, state, "HAS_STATE"])
+                writers["waivers.csv"].writerow(
+                    [
+                        waiver,
+                        row["program_title"],
+                        row["year"],
+                        row["approved_date"],
+                        row["app_type"],
+                        state,
+                        row["content_hash"],
+                        row["theme_summary"],
+                        _vector(row["embedding"]),
+                        "WaiverApplication",
+                    ]
+                )
+                writers["state_has_application.csv"].writerow([state, waiver, "HAS_APPLICATION"])
+                writers["waiver_submitted_by.csv"].writerow([waiver, state, "SUBMITTED_BY"])
+                for key in row["theme_keys"]:
+                    writers["waiver_has_theme.csv"].writerow([waiver, key, "HAS_THEME"])
+            counts["waivers"] += len(batch)
+            counts["themes"] += len(theme_params)
+            if on_progress:
+                on_progress({"event": "csv_batch_written", "rows": counts["waivers"], "total": len(rows)})
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+    return {
+        **counts,
+        "states": len(states),
+        "questions": len(questions),
+        "dims": dims,
+        "out_dir": str(out_dir),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def admin_import_command(out_dir: Optional[Path] = None, database: Optional[str] = None) -> list[str]:
+    """argv for `neo4j-admin database import full` over the exported files."""
+    out_dir = Path(out_dir or config.GRAPH_EXPORT_DIR)
+    cmd = [
+        "neo4j-admin",
+        "database",
+        "import",
+        "full",
+        f"--array-delimiter={ARRAY_DELIMITER}",
+        "--multiline-fields=true",
+        "--overwrite-destination=true",
+    ]
+    cmd += [f"--nodes={out_dir / name}" for name in NODE_FILES]
+    cmd += [f"--relationships={out_dir / name}" for name in RELATIONSHIP_FILES]
+    cmd.append(database or config.NEO4J_DATABASE)
+    return cmd
+
+
+def _load_csv(session, url_prefix: str, on_progress) -> None:
+    for name, statement in _LOAD_STATEMENTS.items():
+        start = time.perf_counter()
+        # CALL { } IN TRANSACTIONS needs an auto-commit transaction, hence session.run.
+        session.run(
+            f"""
+            LOAD CSV WITH HEADERS FROM $url AS row
+            CALL {{ WITH row {statement} }} IN TRANSACTIONS OF {_LOAD_BATCH} ROWS
+            """,
+            url=f"{url_prefix.rstrip('/')}/{name}",
+        ).consume()
+        if on_progress:
+            on_progress({"event": "csv_loaded", "file": name, "seconds": round(time.perf_counter() - start, 2)})
+
+
+def _exported_dims(out_dir: Path) -> int:
+    with open(out_dir / "waivers.csv", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row["embedding:float[]"]:
+                return len(row["embedding:float[]"].split(ARRAY_DELIMITER))
+    raise ValueError(f"No waiver embeddings in {out_dir / 'waivers.csv'}")
+
+
+def finalize_bulk_load(out_dir: Optional[Path] = None, driver=None, on_progress=None) -> dict:
+    """Create constraints and vector indexes, build SIMILAR_TO edges, refresh the in-memory snapshot.
+
+    Run after `neo4j-admin database import` once the database is started
+    again; the LOAD CSV path calls it itself.
+    """
+    out_dir = Path(out_dir or config.GRAPH_EXPORT_DIR)
+    dims = _exported_dims(out_dir)
+    own_driver = driver is None
+    driver = driver or GraphDatabase.driver(config.NEO4J_URI, auth=(config.NEO4J_USER, config.NEO4J_PASSWORD))
+    try:
+        ensure_graph_schema(
+            driver,
+            force=True,
+            vector_indexes=[
+                ("waiver_embeddings", "WaiverApplication", "embedding", dims),
+                ("theme_embeddings", "Theme", "embedding", dims),
+            ],
+        )
+        similarity = build_similarity_edges(driver=driver, full=True, on_progress=on_progress)
+        refresh_memory_snapshot(driver)
+        return similarity
+    finally:
+        if own_driver:
+            driver.close()
+
+
+def run_bulk_load(
+    out_dir: Optional[Path] = None,
+    method: str = "load_csv",
+    url_prefix: Optional[str] = None,
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """Replace the graph with the exported CSVs.
+
+    method="admin" runs neo4j-admin: Neo4j must be local with the database
+    stopped, and `finalize_bulk_load` must be called after restarting it.
+    method="load_csv" runs over Bolt against a running server and finalizes
+    (indexes, SIMILAR_TO edges) itself.
+    """
+    out_dir = Path(out_dir or config.GRAPH_EXPORT_DIR)
+    start = time.perf_counter()
+    if method == "admin":
+        subprocess.run(admin_import_command(out_dir), check=True)
+        return {"method": method, "load_seconds": round(time.perf_counter() - start, 2)}
+
+    driver = GraphDatabase.driver(config.NEO4J_URI, auth=(config.NEO4J_USER, config.NEO4J_PASSWORD))
+    try:
+        with driver.session(database=config.NEO4J_DATABASE) as session:
+            _delete_in_batches(session, "MATCH (n)", "n")
+        # Constraints first, so relationship loads look endpoints up by index.
+        ensure_graph_schema(driver, force=True)
+        with driver.session(database=config.NEO4J_DATABASE) as session:
+            _load_csv(session, url_prefix or config.NEO4J_IMPORT_URL, on_progress)
+        loaded = time.perf_counter() - start
+        finalize_bulk_load(out_dir, driver, on_progress)
+    finally:
+        driver.close()
+    return {
+        "method": method,
+        "load_seconds": round(loaded, 2),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def benchmark_bulk_vs_bolt(
+    file_path: str,
+    provider: str = "ollama",
+    out_dir: Optional[Path] = None,
+    url_prefix: Optional[str] = None,
+) -> dict:
+    """Time a first load through CSV + LOAD CSV against the Bolt ingest loop.
+
+    Both paths embed the sheet, so embedding time is reported separately
+    (from the CSV export) to isolate the database write cost.
+    """
+    exported = export_statewise_csv(file_path, out_dir, provider)
+    bulk = run_bulk_load(out_dir, method="load_csv", url_prefix=url_prefix)
+    bolt = ingest_statewise_kg(file_path, provider, mode="replace")
+    return {
+        "waivers": exported["waivers"],
+        "csv_export_seconds": exported["seconds"],
+        "csv_load_seconds": bulk["load_seconds"],
+        "csv_total_seconds": round(exported["seconds"] + bulk["seconds"], 2),
+        "bolt_total_seconds": bolt["seconds"],
+    }
@@ -1,3 +1,6 @@
+import hashlib
+import json
+import time
 from typing import Optional, Callable
 
 import pandas as pd
@@ -7,6 +10,13 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_openai import OpenAIEmbeddings
 
 from core import config
+from core.ingestion.waiver_similarity import build_similarity_edges
+from core.rag.graph_backend import refresh_memory_snapshot
+from core.storage.graph_schema import ensure_graph_schema
+
+_NON_THEME_COLUMNS = {"Application Number", "Which state (1A)?"}
+_EMBED_BATCH = 256
+_DELETE_BATCH = 1000
 
 
 def _get_provider_config(provider: str):
@@ -15,6 +25,12 @@ def _get_provider_config(provider: str):
     return OllamaEmbeddings(model=config.OLLAMA_EMBEDDING_MODEL, num_ctx=8192), 1024
 
 
+def _embedding_model_tag(provider: str) -> str:
+    if provider == "openai":
+        return f"openai:{config.OPENAI_EMBEDDING_MODEL}"
+    return f"ollama:{config.OLLAMA_EMBEDDING_MODEL}"
+
+
 def _safe_embed(embedder, text):
     if not text:
         return None
@@ -25,95 +41,298 @@ def _safe_embed(embedder, text):
         return None
 
 
+def _safe_embed_many(embedder, texts: list[str]) -> list:
+    # One request per slice; fall back to per-text so one bad input only loses itself.
+    vectors = []
+    for i in range(0, len(texts), _EMBED_BATCH):
+        part = texts[i : i + _EMBED_BATCH]
+        try:
+            vectors.extend(embedder.embed_documents([str(t)[:7000] for t in part]))
+        except Exception:
+            vectors.extend(_safe_embed(embedder, t) for t in part)
+    return vectors
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    if name in df.columns:
+        return df[name]
+    return pd.Series("", index=df.index)
+
+
+def _prepare_rows(df: pd.DataFrame, model_tag: str = "") -> list[dict]:
+    """Turn the spreadsheet into one parameter map per waiver, without iterrows.
+
+    Each row carries a `content_hash` over its fields, its answers and the
+    embedding model, so an upsert can skip waivers that did not change.
+    """
+    df = df.copy()
+    df.columns = df.columns.map(str)
+    df = df.apply(lambda col: col.astype(str).str.strip())
+    df = df[_column(df, "Application Number") != ""]
+
+    rows = pd.DataFrame(
+        {
+            "application_number": _column(df, "Application Number"),
+            "program_title": _column(df, "What is the name of the waiver (1B)?"),
+            "state": _column(df, "Which state (1A)?"),
+            "year": _column(df, "Year"),
+            "approved_date": _column(df, "Approved Effective Date (1E)"),
+            "app_type": _column(df, "Amendment Number").ne("").map({True: "AMENDMENT", False: "NEW"}),
+        }
+    )
+
+    themes = {}
+    theme_cols = [c for c in df.columns if c not in _NON_THEME_COLUMNS]
+    if theme_cols and not df.empty:
+        long = df[theme_cols].stack(future_stack=True)
+        long = long[long != ""].rename_axis(["row", "name"]).reset_index(name="value")
+        long["key"] = (long["name"] + "\x1f" + long["value"]).map(_theme_key)
+        themes = {
+            row: group[["key", "name", "value"]].to_dict("records")
+            for row, group in long.groupby("row", sort=False)
+        }
+    rows["themes"] = [themes.get(idx, []) for idx in rows.index]
+    records = rows.drop_duplicates("application_number", keep="last").to_dict("records")
+    for row in records:
+        fields = {k: v for k, v in row.items() if k != "themes"}
+        payload = json.dumps([model_tag, fields, sorted(t["key"] for t in row["themes"])], sort_keys=True)
+        row["content_hash"] = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    return records
+
+
+def _theme_key(name_and_value: str) -> str:
+    return hashlib.sha1(name_and_value.encode("utf-8")).hexdigest()
+
+
+def _theme_summary(themes: list[dict]) -> str:
+    # Same shape retrieval used to collect() at query time, stored once per waiver.
+    return json.dumps(
+        [{"type": "Theme", "name": t["name"], "value": t["value"]} for t in themes],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+
+
+def _batch_params(embedder, batch: list[dict], seen: set[str]) -> tuple[list[dict], list[dict]]:
+    """Build Cypher parameters for a batch, embedding only answers not yet written."""
+    new_themes: dict[str, dict] = {}
+    for row in batch:
+        for theme in row["themes"]:
+            if theme["key"] not in seen:
+                new_themes.setdefault(theme["key"], theme)
+
+    summaries = [
+        f"{r['program_title']} in {r['state']}. {r['app_type']} application." for r in batch
+    ]
+    theme_texts = [f"{t['name']}: {t['value']}" for t in new_themes.values()]
+    vectors = _safe_embed_many(embedder, summaries + theme_texts)
+
+    row_params = [
+        {
+            **{k: v for k, v in row.items() if k != "themes"},
+            "embedding": vector,
+            "theme_keys": [t["key"] for t in row["themes"]],
+            "theme_summary": _theme_summary(row["themes"]),
+        }
+        for row, vector in zip(batch, vectors)
+    ]
+    theme_params = [
+        {**theme, "embedding": vector}
+        for theme, vector in zip(new_themes.values(), vectors[len(batch):])
+    ]
+    seen.update(new_themes)
+    return row_params, theme_params
+
+
+def _delete_in_batches(session, match: str, var: str, batch_size: int = _DELETE_BATCH, **params) -> int:
+    # CALL { } IN TRANSACTIONS needs an auto-commit transaction, hence session.run.
+    summary = session.run(
+        f"""
+        {match}
+        CALL {{ WITH {var} DETACH DELETE {var} }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+        """,
+        **params,
+    ).consume()
+    return summary.counters.nodes_deleted
+
+
+def _existing_state(session, model_tag: str) -> tuple[dict[str, str], set[str]]:
+    # Waivers written before theme summaries existed count as changed.
+    hashes = {
+        r["id"]: r["hash"]
+        for r in session.run(
+            """
+            MATCH (w:WaiverApplication)
+            RETURN w.applicationNumber AS id,
+                   CASE WHEN w.themeSummary IS NULL THEN null ELSE w.contentHash END AS hash
+            """
+        )
+    }
+    theme_keys = {
+        r["key"]
+        for r in session.run(
+            "MATCH (t:Theme) WHERE t.embeddingModel = $model RETURN t.key AS key",
+            model=model_tag,
+        )
+    }
+    return hashes, theme_keys
+
+
 def ingest_statewise_kg(
     file_path: str,
     provider: str = "ollama",
     on_progress: Optional[Callable[[dict], None]] = None,
+    batch_size: int = 500,
+    mode: str = "upsert",
 ) -> dict:
+    """Load the statewise spreadsheet into Neo4j.
+
+    mode="upsert" (default) writes only waivers whose content hash changed,
+    reuses embeddings of answers already in the graph and removes waivers no
+    longer in the sheet. mode="replace" clears the database first. All bulk
+    deletes run in bounded batches. SIMILAR_TO edges are refreshed last.
+    """
     provider = provider.lower()
     embedder, dims = _get_provider_config(provider)
+    model_tag = _embedding_model_tag(provider)
 
     df = pd.read_excel(file_path, dtype=str).fillna("")
+    rows = _prepare_rows(df, model_tag)
 
+    # execute_write retries transient errors (deadlocks, leader switches) for up
+    # to max_transaction_retry_time before giving up on a batch.
     driver = GraphDatabase.driver(
-        config.NEO4J_URI, auth=(config.NEO4J_USER, config.NEO4J_PASSWORD)
+        config.NEO4J_URI,
+        auth=(config.NEO4J_USER, config.NEO4J_PASSWORD),
+        max_transaction_retry_time=60,
     )
 
-    created = 0
-    with driver.session(database=config.NEO4J_DATABASE) as session:
-        session.run("MATCH (n) DETACH DELETE n")
-        session.run(
-            f"""
-            CREATE VECTOR INDEX waiver_embeddings IF NOT EXISTS
-            FOR (w:WaiverApplication) ON (w.embedding)
-            OPTIONS {{indexConfig: {{
-              `vector.dimensions`: {dims},
-              `vector.similarity_function`: 'cosine'
-            }}}}
-            """
-        )
+    # Clear before creating the schema: constraint creation fails on a legacy
+    # graph with duplicate keys, and replace is how such a graph is recovered.
+    if mode == "replace":
+        with driver.session(database=config.NEO4J_DATABASE) as session:
+            _delete_in_batches(session, "MATCH (n)", "n")
+    ensure_graph_schema(
+        driver,
+        force=True,
+        vector_indexes=[
+            ("waiver_embeddings", "WaiverApplication", "embedding", dims),
+            ("theme_embeddings", "Theme", "embedding", dims),
+        ],
+    )
 
-        for _, row in df.iterrows():
-            app_num = str(row.get("Application Number", "")).strip()
-            if not app_num:
-                continue
-
-            props = {
-                "application_number": app_num,
-                "program_title": str(row.get("What is the name of the waiver (1B)?", "")).strip(),
-                "state": str(row.get("Which state (1A)?", "")).strip(),
-                "year": str(row.get("Year", "")).strip(),
-                "approved_date": str(row.get("Approved Effective Date (1E)", "")).strip(),
-                "app_type": "AMENDMENT" if row.get("Amendment Number") else "NEW",
+    with driver.session(database=config.NEO4J_DATABASE) as session:
+        existing, seen_themes = _existing_state(session, model_tag)
+    changed = [r for r in rows if existing.get(r["application_number"]) != r["content_hash"]]
+    known_themes = len(seen_themes)
+    if on_progress:
+        on_progress(
+            {
+                "event": "diff_computed",
+                "total": len(rows),
+                "changed": len(changed),
+                "unchanged": len(rows) - len(changed),
             }
+        )
 
-            summary = f"{props['program_title']} in {props['state']}. {props['app_type']} application."
-            props["embedding"] = _safe_embed(embedder, summary)
-
-            themes = []
-            for col, val in row.items():
-                if col not in ["Application Number", "Which state (1A)?"] and str(val).strip():
-                    themes.append(
-                        {
-                            "name": col,
-                            "value": val,
-                            "embedding": _safe_embed(embedder, f"{col}: {val}"),
-                        }
-                    )
-
-            _cypher_ingest(session, props, themes)
-            created += 1
+    created = 0
+    start = time.perf_counter()
+    with driver.session(database=config.NEO4J_DATABASE) as session:
+        for i in range(0, len(changed), batch_size):
+            batch = changed[i : i + batch_size]
+            row_params, theme_params = _batch_params(embedder, batch, seen_themes)
+            for theme in theme_params:
+                theme["model"] = model_tag
+            session.execute_write(_cypher_ingest, row_params, theme_params)
+            created += len(batch)
             if on_progress:
-                on_progress({"event": "row_ingested", "application_number": app_num})
+                elapsed = time.perf_counter() - start
+                on_progress(
+                    {
+                        "event": "batch_ingested",
+                        "rows": created,
+                        "total": len(changed),
+                        "batch_rows": len(batch),
+                        "rows_per_sec": round(created / elapsed, 1) if elapsed else None,
+                    }
+                )
 
+        removed = _delete_in_batches(
+            session,
+            "MATCH (w:WaiverApplication) WHERE NOT w.applicationNumber IN $keep",
+            "w",
+            keep=[r["application_number"] for r in rows],
+        )
+        removed += _delete_in_batches(session, "MATCH (t:Theme) WHERE NOT ()-[:HAS_THEME]->(t)", "t")
+        removed += _delete_in_batches(session, "MATCH (q:Question) WHERE NOT ()-[:ANSWERS]->(q)", "q")
+        if on_progress and removed:
+            on_progress({"event": "pruned", "nodes_deleted": removed})
+
+    # Only waivers whose neighbourhood may have changed are recomputed.
+    similarity = build_similarity_edges(driver=driver, on_progress=on_progress)
+    snapshot = refresh_memory_snapshot(driver)
+    if on_progress and snapshot:
+        on_progress({"event": "memory_snapshot", "path": str(snapshot)})
     driver.close()
-    return {"ingested": created}
+    return {
+        "ingested": created,
+        "unchanged": len(rows) - len(changed),
+        "removed_nodes": removed,
+        "new_themes": len(seen_themes) - known_themes,
+        "similarity_recomputed": similarity["recomputed"],
+        "seconds": round(time.perf_counter() - start, 2),
+    }
 
 
-def _cypher_ingest(session, props, themes):
-    query = """
+def _cypher_ingest(tx, rows, themes):
+    # Schema: one Question per spreadsheet column, one Theme per distinct
+    # (column, answer) shared by every waiver that gave that answer, and a
+    # single HAS_THEME edge from waiver to answer. Each waiver also carries
+    # its state name and answers as JSON so retrieval needs no traversal.
+    theme_query = """
+    UNWIND $themes AS tData
+    MERGE (q:Question {name: tData.name})
+    MERGE (t:Theme {key: tData.key})
+    SET t.name = tData.name,
+        t.value = tData.value,
+        t.embedding = tData.embedding,
+        t.embeddingModel = tData.model
+    MERGE (t)-[:ANSWERS]->(q)
+    """
+    waiver_query = """
     MERGE (c:Country {name: 'United States'})
-    MERGE (s:State {name: $props.state})
+    WITH c
+    UNWIND $rows AS row
+    MERGE (s:State {name: row.state})
     MERGE (s)-[:LOCATED_IN]->(c)
     MERGE (c)-[:HAS_STATE]->(s)
 
-    CREATE (w:WaiverApplication {
-        applicationNumber: $props.application_number,
-        programTitle: $props.program_title,
-        year: $props.year,
-        approvedDate: $props.approved_date,
-        applicationType: $props.app_type,
-        embedding: $props.embedding
-    })
+    MERGE (w:WaiverApplication {applicationNumber: row.application_number})
+    SET w.programTitle = row.program_title,
+        w.year = row.year,
+        w.approvedDate = row.approved_date,
+        w.applicationType = row.app_type,
+        w.embedding = row.embedding,
+        w.contentHash = row.content_hash,
+        w.stateName = row.state,
+        w.themeSummary = row.theme_summary
 
+    // A changed row replaces its state link and answer set.
+    WITH s, w, row
+    CALL {
+        WITH s, w
+        OPTIONAL MATCH (w)-[old]-(other)
+        WHERE (type(old) = 'HAS_THEME')
+           OR (type(old) IN ['SUBMITTED_BY', 'HAS_APPLICATION'] AND other <> s)
+        DELETE old
+    }
     MERGE (w)-[:SUBMITTED_BY]->(s)
     MERGE (s)-[:HAS_APPLICATION]->(w)
 
-    WITH w
-    UNWIND $themes AS tData
-    CREATE (t:Theme {name: tData.name, value: tData.value, embedding: tData.embedding})
-
-    CREATE (w)-[:HAS_THEME]->(t)
-    CREATE (t)-[:BELONGS_TO]->(w)
+    WITH w, row
+    UNWIND row.theme_keys AS key
+    MATCH (t:Theme {key: key})
+    MERGE (w)-[:HAS_THEME]->(t)
     """
-    session.run(query, props=props, themes=themes)
+    tx.run(theme_query, themes=themes).consume()
+    tx.run(waiver_query, rows=rows).consume()
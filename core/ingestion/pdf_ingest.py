@@ -4,19 +4,28 @@ import os
 import re
 import shutil
 import signal
+import uuid
 from pathlib import Path
 from typing import Callable, Optional
 
 import fitz  # PyMuPDF
 import lancedb
+import pyarrow as pa
 
-from langchain_community.vectorstores import LanceDB
 from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings
 from langchain_openai import OpenAIEmbeddings
 
 from core import config
-from core.storage.sqlite_storage import clear_all, init_db, insert_chunk, insert_document
+from core.storage.lance_index import (
+    ensure_fts_index,
+    ensure_scalar_indexes,
+    ensure_vector_index,
+    migrate_policy_docs_columns,
+    policy_docs_schema,
+)
+from core.storage.sqlite_storage import clear_all, init_db, insert_chunks, insert_document
+from core.storage.vector_quant import ensure_compact_index
 from core.extraction.extraction_utils import extract_waiver_info, parse_effective_date
 
 
@@ -57,6 +66,41 @@ def _build_upload_path(state: str, waiver_number: str, approved_date, filename:
     return config.UPLOADS_DIR / state_folder / new_filename
 
 
+def _append_policy_chunks(db, embedder, docs: list[Document], year: Optional[int]) -> None:
+    """Write chunks to policy_docs in the LangChain layout plus filterable columns."""
+    vectors = embedder.embed_documents([d.page_content for d in docs])
+    rows = [
+        {
+            "vector": vector,
+            "id": str(uuid.uuid4()),
+            "text": doc.page_content,
+            "metadata": doc.metadata,
+            "state": doc.metadata["state"],
+            "doc_id": doc.metadata["doc_id"],
+            "page": doc.metadata["page"],
+            "year": year,
+        }
+        for doc, vector in zip(docs, vectors)
+    ]
+    data = pa.Table.from_pylist(rows, schema=policy_docs_schema(len(vectors[0])))
+    if "policy_docs" not in db.table_names():
+        db.create_table("policy_docs", data=data)
+        return
+    table = db.open_table("policy_docs")
+    if set(data.schema.names) - set(table.schema.names):
+        # Written before the filter columns existed: add them first.
+        migrate_policy_docs_columns()
+        table = db.open_table("policy_docs")
+    try:
+        data = data.select(table.schema.names).cast(table.schema)
+    except (KeyError, ValueError, pa.ArrowException) as exc:
+        raise ValueError(
+            f"Existing policy_docs table does not match the chunk layout ({exc}). "
+            "Re-run ingestion with clear_existing=True to rebuild it."
+        ) from exc
+    table.add(data)
+
+
 def ingest_pdf_folder(
     data_folder: str,
     provider: str,
@@ -70,7 +114,6 @@ def ingest_pdf_folder(
     Returns a summary dict with counts.
     """
     data_path = Path(data_folder).resolve()
-    db_path = str(config.LANCE_DB_PATH)
     state_to_code = {name.lower(): code for code, name in config.US_STATES}
 
     if not data_path.exists():
@@ -147,42 +190,34 @@ def ingest_pdf_folder(
                 extra=extra_metadata,
             )
 
-            doc_vector_buffer: list[Document] = []
+            pages: list[tuple[str, int, int]] = []
             with fitz.open(pdf_path) as doc_pdf:
                 for i, page in enumerate(doc_pdf):
                     text = page.get_text("text").strip()
-                    if not text:
-                        continue
-
-                    chunk_id = insert_chunk(
-                        document_id=doc_id,
-                        text=text,
-                        page=i + 1,
-                        order_index=i,
-                    )
-                    doc_vector_buffer.append(
-                        Document(
-                            page_content=text,
-                            metadata={
-                                "chunk_id": chunk_id,
-                                "doc_id": doc_id,
-                                "state": state_code,
-                                "source_path": rel_path,
-                                "page": i + 1,
-                            },
-                        )
-                    )
+                    if text:
+                        pages.append((text, i + 1, i))
+
+            # One queued write per document instead of one per page.
+            chunk_ids = insert_chunks(doc_id, pages)
+            doc_vector_buffer: list[Document] = [
+                Document(
+                    page_content=text,
+                    metadata={
+                        "chunk_id": chunk_id,
+                        "doc_id": doc_id,
+                        "state": state_code,
+                        "source_path": rel_path,
+                        "page": page_num,
+                    },
+                )
+                for (text, page_num, _), chunk_id in zip(pages, chunk_ids)
+            ]
 
             signal.alarm(0)
 
             if doc_vector_buffer:
-                table_mode = "overwrite" if "policy_docs" not in db.table_names() else "append"
-                LanceDB.from_documents(
-                    doc_vector_buffer,
-                    embedder,
-                    uri=db_path,
-                    table_name="policy_docs",
-                    mode=table_mode,
+                _append_policy_chunks(
+                    db, embedder, doc_vector_buffer, approved_date.year if approved_date else None
                 )
 
             indexed_data[rel_path] = file_hash
@@ -206,6 +241,17 @@ def ingest_pdf_folder(
     elif track_path.exists():
         os.remove(track_path)
 
+    if "policy_docs" in db.table_names():
+        table = db.open_table("policy_docs")
+        ensure_scalar_indexes(table)
+        ensure_fts_index(table)
+        index = ensure_vector_index(table)
+        if on_progress and index["action"] != "none":
+            on_progress({"event": "ann_index", **index})
+        compact = ensure_compact_index("policy_docs")
+        if on_progress and compact and compact["action"] != "none":
+            on_progress({"event": "compact_index", **compact})
+
     return {
         "processed": processed,
         "skipped": skipped,
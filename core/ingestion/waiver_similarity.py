@@ -0,0 +1,185 @@
+"""Precomputed SIMILAR_TO edges between waiver applications.
+
+All waiver embeddings are loaded into one matrix and each waiver's top-k
+cosine neighbours are found with blocked matrix products, so "waivers like
+this one" becomes an index traversal instead of a live vector query.
+
+A waiver is recomputed only when its contentHash differs from the hash its
+edges were built from (`similarityHash`), when it has fewer than k edges
+(a neighbour was deleted), when it points at a recomputed waiver, or when
+a recomputed waiver now scores above its weakest current neighbour.
+"""
+import time
+from typing import Callable, Optional
+
+import numpy as np
+from neo4j import GraphDatabase
+
+from core import config
+
+_BLOCK_ROWS = 1024
+_WRITE_BATCH = 500
+
+
+def _load(session) -> dict:
+    rows = session.run(
+        """
+        MATCH (w:WaiverApplication)
+        WHERE w.embedding IS NOT NULL
+        OPTIONAL MATCH (w)-[r:SIMILAR_TO]->(n:WaiverApplication)
+        RETURN w.applicationNumber AS id,
+               w.embedding AS embedding,
+               w.contentHash AS hash,
+               w.similarityHash AS built_from,
+               w.similarityK AS built_k,
+               collect(n.applicationNumber) AS neighbours,
+               min(r.score) AS weakest
+        """
+    ).data()
+    # Waivers embedded with another model (different size) cannot be compared.
+    dims = max((len(r["embedding"]) for r in rows), default=0)
+    rows = [r for r in rows if len(r["embedding"]) == dims]
+    matrix = np.asarray([r["embedding"] for r in rows], dtype=np.float32).reshape(len(rows), dims)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+    return {"rows": rows, "matrix": matrix}
+
+
+def top_k_neighbours(
+    matrix: np.ndarray, query_rows: np.ndarray, k: int, block_rows: int = _BLOCK_ROWS
+) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbours (excluding self) of `query_rows` within L2-normalized `matrix`.
+
+    Scores are computed `block_rows` queries at a time so memory stays at
+    block_rows x len(matrix) floats. Returns (indices, scores), best first.
+    """
+    k = min(k, len(matrix) - 1)
+    indices = np.empty((len(query_rows), max(k, 0)), dtype=np.int64)
+    scores = np.empty((len(query_rows), max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return indices, scores
+    for start in range(0, len(query_rows), block_rows):
+        block = query_rows[start : start + block_rows]
+        sims = matrix[block] @ matrix.T
+        sims[np.arange(len(block)), block] = -np.inf
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        part_scores = np.take_along_axis(sims, part, axis=1)
+        order = np.argsort(-part_scores, axis=1)
+        indices[start : start + len(block)] = np.take_along_axis(part, order, axis=1)
+        scores[start : start + len(block)] = np.take_along_axis(part_scores, order, axis=1)
+    return indices, scores
+
+
+def _dirty_rows(rows: list[dict], matrix: np.ndarray, k: int, block_rows: int) -> np.ndarray:
+    expected = min(k, len(rows) - 1)
+    changed = np.array(
+        [
+            r["built_from"] is None
+            or r["built_from"] != r["hash"]
+            or r["built_k"] != k
+            or len(r["neighbours"]) < expected
+            for r in rows
+        ],
+        dtype=bool,
+    )
+    if not changed.any() or changed.all():
+        return np.flatnonzero(changed)
+
+    changed_ids = {rows[i]["id"] for i in np.flatnonzero(changed)}
+    affected = changed.copy()
+    for i, r in enumerate(rows):
+        if not affected[i] and any(n in changed_ids for n in r["neighbours"]):
+            affected[i] = True
+
+    # A changed waiver may now beat some clean waiver's weakest neighbour.
+    weakest = np.array(
+        [r["weakest"] if r["weakest"] is not None else -np.inf for r in rows], dtype=np.float32
+    )
+    changed_idx = np.flatnonzero(changed)
+    for start in range(0, len(changed_idx), block_rows):
+        block = changed_idx[start : start + block_rows]
+        sims = matrix[block] @ matrix.T
+        sims[np.arange(len(block)), block] = -np.inf
+        affected |= (sims > weakest).any(axis=0)
+    return np.flatnonzero(affected)
+
+
+def _write_edges(tx, rows: list[dict], k: int) -> None:
+    tx.run(
+        """
+        UNWIND $rows AS row
+        MATCH (w:WaiverApplication {applicationNumber: row.id})
+        OPTIONAL MATCH (w)-[old:SIMILAR_TO]->()
+        DELETE old
+        WITH DISTINCT w, row
+        SET w.similarityHash = w.contentHash, w.similarityK = $k
+        WITH w, row
+        UNWIND row.neighbours AS n
+        MATCH (other:WaiverApplication {applicationNumber: n.id})
+        CREATE (w)-[:SIMILAR_TO {score: n.score}]->(other)
+        """,
+        rows=rows,
+        k=k,
+    ).consume()
+
+
+def build_similarity_edges(
+    k: int = None,
+    driver=None,
+    full: bool = False,
+    block_rows: int = _BLOCK_ROWS,
+    on_progress: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """Refresh (w)-[:SIMILAR_TO {score}]->(n) for waivers whose neighbours may have changed.
+
+    `full=True` recomputes every waiver regardless of the stored hashes.
+    """
+    k = k or config.GRAPH_SIMILAR_K
+    own_driver = driver is None
+    driver = driver or GraphDatabase.driver(
+        config.NEO4J_URI,
+        auth=(config.NEO4J_USER, config.NEO4J_PASSWORD),
+        max_transaction_retry_time=60,
+    )
+    start = time.perf_counter()
+    try:
+        with driver.session(database=config.NEO4J_DATABASE) as session:
+            loaded = _load(session)
+            rows, matrix = loaded["rows"], loaded["matrix"]
+            if full:
+                dirty = np.arange(len(rows))
+            else:
+                dirty = _dirty_rows(rows, matrix, k, block_rows)
+            if on_progress:
+                on_progress({"event": "similarity_diff", "total": len(rows), "recompute": len(dirty)})
+
+            indices, scores = top_k_neighbours(matrix, dirty, k, block_rows)
+            params = [
+                {
+                    "id": rows[i]["id"],
+                    "neighbours": [
+                        {"id": rows[j]["id"], "score": float(s)} for j, s in zip(idx, sc)
+                    ],
+                }
+                for i, idx, sc in zip(dirty, indices, scores)
+            ]
+            for offset in range(0, len(params), _WRITE_BATCH):
+                session.execute_write(_write_edges, params[offset : offset + _WRITE_BATCH], k)
+                if on_progress:
+                    on_progress(
+                        {
+                            "event": "similarity_written",
+                            "rows": min(offset + _WRITE_BATCH, len(params)),
+                            "total": len(params),
+                        }
+                    )
+    finally:
+        if own_driver:
+            driver.close()
+
+    return {
+        "waivers": len(rows),
+        "recomputed": len(params),
+        "edges": sum(len(p["neighbours"]) for p in params),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
@@ -0,0 +1,69 @@
+"""Fit retrieved graph data into an LLM prompt under a token budget."""
+import json
+from typing import Any, Dict, List
+
+# Rough English/JSON average; good enough for budgeting without a tokenizer.
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _fit_node(node: Dict[str, Any], budget: int) -> Dict[str, Any] | None:
+    """Return the node, with its themes trimmed if needed, or None if it cannot fit."""
+    if estimate_tokens(_dumps(node)) <= budget:
+        return node
+    themes = node.get("themes") or []
+    lo, hi = 0, len(themes) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = {**node, "themes": themes[:mid], "themes_truncated": True}
+        if estimate_tokens(_dumps(candidate)) <= budget:
+            best, lo = candidate, mid + 1
+        else:
+            hi = mid - 1
+    return best
+
+
+def pack_graph_context(graph: Dict[str, Any], token_budget: int) -> Dict[str, Any]:
+    """Keep the highest-scoring nodes (and their edges) that fit in `token_budget`.
+
+    Nodes are added in score order; the first node that does not fit whole
+    gets its themes trimmed and packing stops there.
+    """
+    nodes: List[Dict[str, Any]] = sorted(
+        graph.get("nodes", []), key=lambda n: n.get("score") or 0, reverse=True
+    )
+    packed: List[Dict[str, Any]] = []
+    remaining = token_budget
+    for node in nodes:
+        fitted = _fit_node(node, remaining)
+        if fitted is None:
+            break
+        packed.append(fitted)
+        remaining -= estimate_tokens(_dumps(fitted))
+        if fitted is not node:
+            break
+
+    kept = {n["id"] for n in packed}
+    edges = []
+    for edge in graph.get("edges", []):
+        if edge.get("from") not in kept:
+            continue
+        cost = estimate_tokens(_dumps(edge))
+        if cost > remaining:
+            break
+        edges.append(edge)
+        remaining -= cost
+
+    return {
+        "nodes": packed,
+        "edges": edges,
+        "omitted_nodes": len(nodes) - len(packed),
+    }
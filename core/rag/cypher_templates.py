@@ -0,0 +1,133 @@
+"""Parameterized Cypher templates for the common Graph RAG question shapes.
+
+`route_question` recognizes questions such as "waivers in Texas about respite
+care" or "which states mention crisis stabilization" from state names and
+topic keywords, and returns a ready-to-run template so the pipeline can skip
+the LLM planning calls. Counting and aggregation questions, and anything
+without a topic, are left to LLM drafting: the templates only rank by
+similarity. Templates are reviewed by hand: read-only, index-backed
+and bounded by $k, so they bypass the EXPLAIN guard.
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from core import config
+
+# Two-letter codes that are also common English words; only matched as names.
+_AMBIGUOUS_CODES = {"IN", "OR", "ME", "OK", "HI"}
+
+# Postal codes count only in a state context: "in TX", "TX waivers", "TX's".
+_CODE_BEFORE = r"\b(?i:in|for|from|of)\s+({code})\b"
+_CODE_AFTER = r"\b({code})(?:'s)?\s+(?i:waivers?|programs?|applications?|plans?)\b"
+
+_STATES_QUESTION = re.compile(
+    r"\b(which|what)\s+states?\b|\bstates\s+(that|which|with|where)\b",
+    re.IGNORECASE,
+)
+
+# The templates answer "about <topic>" questions; without one there is nothing to rank by.
+_TOPIC = re.compile(
+    r"\b(about|regarding|concerning|related\s+to|mention(s|ed|ing)?|cover(s|ed|ing)?|"
+    r"offer(s|ed|ing)?|provid(e|es|ed|ing)|include(s|d)?|including|describ(e|es|ed|ing)|"
+    r"address(es|ed|ing)?|support(s|ed|ing)?|use(s|d)?|using)\b",
+    re.IGNORECASE,
+)
+
+# Counts, totals and rankings need aggregation the similarity templates cannot do.
+_AGGREGATE = re.compile(
+    r"\b(how\s+many|how\s+much|number\s+of|count(s|ed|ing)?|total|sum|average|mean|"
+    r"most|least|fewest|more\s+than|less\s+than|fewer\s+than|percent(age)?|proportion|"
+    r"share\s+of|compare|comparison|per\s+state|by\s+state|each\s+state|every\s+state|list\s+all)\b",
+    re.IGNORECASE,
+)
+
+# Vector hits are answers (Theme nodes); over-fetch so that grouping them into
+# waivers, and filtering by state, still leaves $k rows.
+_FETCH_FACTOR = 20
+
+STATE_TOPIC = """
+CALL db.index.vector.queryNodes('theme_embeddings', $fetch, $vector)
+YIELD node AS t, score
+MATCH (s:State)-[:HAS_APPLICATION]->(w:WaiverApplication)-[:HAS_THEME]->(t)
+WHERE toLower(s.name) IN $states
+WITH w, s, max(score) AS score,
+     collect(DISTINCT {type: "Theme", name: t.name, value: t.value})[..5] AS themes
+RETURN w.applicationNumber AS waiver_id, w.programTitle AS title, s.name AS state, themes, score
+ORDER BY score DESC
+LIMIT $k
+"""
+
+STATES_MENTIONING = """
+CALL db.index.vector.queryNodes('theme_embeddings', $fetch, $vector)
+YIELD node AS t, score
+MATCH (s:State)-[:HAS_APPLICATION]->(w:WaiverApplication)-[:HAS_THEME]->(t)
+WITH w, s, max(score) AS score,
+     collect(DISTINCT {type: "Theme", name: t.name, value: t.value})[..5] AS themes
+RETURN w.applicationNumber AS waiver_id, w.programTitle AS title, s.name AS state, themes, score
+ORDER BY score DESC
+LIMIT $k
+"""
+
+TEMPLATES = {"state_topic": STATE_TOPIC, "states_mentioning": STATES_MENTIONING}
+
+
+def template_for(cypher: str) -> Optional[str]:
+    """Name of the template `cypher` was built from, if any."""
+    text = " ".join(cypher.split())
+    for name, template in TEMPLATES.items():
+        if text == " ".join(template.split()):
+            return name
+    return None
+
+
+def find_states(question: str) -> List[str]:
+    """Return full state names mentioned in the question, by name or postal code."""
+    matches = []  # (start, end, name)
+    lowered = question.lower()
+    for code, name in config.US_STATES:
+        for m in re.finditer(rf"\b{re.escape(name.lower())}\b", lowered):
+            matches.append((m.start(), m.end(), name))
+        if code in _AMBIGUOUS_CODES:
+            continue
+        for pattern in (_CODE_BEFORE, _CODE_AFTER):
+            for m in re.finditer(pattern.format(code=code), question):
+                matches.append((m.start(1), m.end(1), name))
+    # "Virginia" inside "West Virginia" is part of the longer match, not a second state.
+    kept = [
+        (start, name)
+        for start, end, name in matches
+        if not any(s <= start and end <= e and e - s > end - start for s, e, _ in matches)
+    ]
+    found = []
+    for _, name in sorted(kept):
+        if name not in found:
+            found.append(name)
+    return found
+
+
+def route_question(question: str, k: int = 10) -> Optional[Dict[str, Any]]:
+    """Match a question to a template, or return None to fall back to LLM drafting."""
+    if _AGGREGATE.search(question) or not _TOPIC.search(question):
+        return None
+    states = find_states(question)
+    if _STATES_QUESTION.search(question):
+        return {
+            "template": "states_mentioning",
+            "cypher_query": STATES_MENTIONING.strip(),
+            "cypher_params": {"k": k, "fetch": k * _FETCH_FACTOR},
+            "filters": {},
+            "execution_plan": "Template: rank waivers by their closest answers and report each state.",
+        }
+    if states:
+        return {
+            "template": "state_topic",
+            "cypher_query": STATE_TOPIC.strip(),
+            "cypher_params": {
+                "k": k,
+                "fetch": k * _FETCH_FACTOR * len(states),
+                "states": [s.lower() for s in states],
+            },
+            "filters": {"states": states},
+            "execution_plan": f"Template: waivers in {', '.join(states)} ranked by closest answers.",
+        }
+    return None
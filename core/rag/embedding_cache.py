@@ -0,0 +1,132 @@
+"""Query-embedding cache shared by the text, graph and coded-example retrievers.
+
+Streamlit re-runs the page script on every widget change, so the same
+question gets embedded again and again. `CachedEmbeddings` wraps a
+LangChain embedder and answers `embed_query` from an in-process LRU keyed by
+(provider, model, text); with EMBED_CACHE_DISK the vectors are also kept in
+the SQLite `query_embeddings` table so they survive restarts. Document
+embedding (`embed_documents`) is passed through uncached.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from core import config
+from core.storage import sqlite_storage
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = 1024, disk: bool = False):
+        self.max_entries = max_entries
+        self.disk = disk
+        self._entries: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, model_key: str, text: str) -> Optional[list[float]]:
+        key = (model_key, self._hash(text))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+        if self.disk:
+            blob = sqlite_storage.get_query_embedding(*key)
+            if blob is not None:
+                vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                self._remember(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, model_key: str, text: str, vector: list[float]) -> None:
+        key = (model_key, self._hash(text))
+        self._remember(key, vector)
+        if self.disk:
+            sqlite_storage.put_query_embedding(*key, np.asarray(vector, dtype=np.float32).tobytes())
+
+    def _remember(self, key: tuple[str, str], vector: list[float]) -> None:
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+
+_cache = EmbeddingCache(config.EMBED_CACHE_SIZE, config.EMBED_CACHE_DISK)
+
+
+def cache_stats() -> dict:
+    return _cache.stats()
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain embedder whose `embed_query` goes through the shared cache."""
+
+    def __init__(self, embedder: Embeddings, model_key: str, cache: EmbeddingCache = _cache):
+        self.embedder = embedder
+        self.model_key = model_key
+        self.cache = cache
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get(self.model_key, text)
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self.cache.put(self.model_key, text, vector)
+        return vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embedder.embed_documents(texts)
+
+
+def query_embedder(provider: Optional[str] = None) -> CachedEmbeddings:
+    """Cached query embedder for `provider` (defaults to AI_PROVIDER) and its configured model."""
+    provider = (provider or config.AI_PROVIDER).upper()
+    if provider == "OPENAI":
+        return _query_embedder(provider, config.OPENAI_EMBEDDING_MODEL)
+    return _query_embedder("OLLAMA", config.OLLAMA_EMBEDDING_MODEL)
+
+
+@lru_cache(maxsize=None)
+def _query_embedder(provider: str, model: str) -> CachedEmbeddings:
+    # Keyed by model too: the sidebar can switch models at runtime.
+    if provider == "OPENAI":
+        from langchain_openai import OpenAIEmbeddings
+
+        embedder = OpenAIEmbeddings(model=model)
+    else:
+        from langchain_ollama import OllamaEmbeddings
+
+        embedder = OllamaEmbeddings(model=model)
+    return CachedEmbeddings(embedder, f"{provider}:{model}")
@@ -0,0 +1,438 @@
+"""Storage backends behind GraphRetriever.
+
+`Neo4jGraphBackend` runs everything over Bolt. `InMemoryGraphBackend`
+holds the waiver graph as NumPy vector matrices plus adjacency dicts and
+answers `retrieve_graph`, `similar_waivers`, `retrieve_themes` and the
+Cypher templates in-process, so small deployments skip the server round
+trips and the pipeline can run offline. It cannot run arbitrary Cypher;
+drafted queries return no rows and the pipeline falls back to the
+prefetched vector hits.
+
+Backends return plain records (dicts with waiver_id, title, state, themes,
+score); GraphRetriever turns them into nodes and edges. Every score is on the
+Neo4j cosine vector-index scale, (1 + cos) / 2 in [0, 1], whichever backend
+or query produced it.
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Optional
+
+import os
+
+import numpy as np
+from neo4j import GraphDatabase
+
+from core import config
+from core.rag import cypher_templates
+
+_VECTOR_MIN_LENGTH = 32
+
+
+def _is_vector(value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) >= _VECTOR_MIN_LENGTH
+        and all(isinstance(v, float) for v in value[:_VECTOR_MIN_LENGTH])
+    )
+
+
+def _strip_vectors(value):
+    """Recursively drop embedding-like float arrays (e.g. from `w { .* }`)."""
+    if isinstance(value, dict):
+        return {k: _strip_vectors(v) for k, v in value.items() if not _is_vector(v)}
+    if isinstance(value, list) and not _is_vector(value):
+        return [_strip_vectors(v) for v in value if not _is_vector(v)]
+    return value
+
+
+class GraphBackend:
+    def run_query(self, cypher: str, params: dict, max_rows: int) -> tuple[list[dict], bool]:
+        """Run a read query; return (records, truncated)."""
+        raise NotImplementedError
+
+    def retrieve_graph(self, query_vec: list[float], k: int) -> list[dict]:
+        raise NotImplementedError
+
+    def similar_waivers(self, application_number: str, k: int) -> list[dict]:
+        raise NotImplementedError
+
+    def retrieve_themes(self, query_vec: list[float], k: int, state_name: Optional[str]) -> list[dict]:
+        raise NotImplementedError
+
+    def explain(self, cypher: str, params: dict) -> dict:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class Neo4jGraphBackend(GraphBackend):
+    def __init__(self, driver=None):
+        self.driver = driver or GraphDatabase.driver(
+            config.NEO4J_URI,
+            auth=(config.NEO4J_USER, config.NEO4J_PASSWORD)
+        )
+
+    def run_query(self, cypher: str, params: dict, max_rows: int) -> tuple[list[dict], bool]:
+        # Records are streamed in batches of GRAPH_FETCH_SIZE and reading
+        # stops after max_rows.
+        truncated = False
+        records = []
+        with self.driver.session(
+            database=config.NEO4J_DATABASE, fetch_size=config.GRAPH_FETCH_SIZE
+        ) as session:
+            try:
+                result = session.run(cypher, **params)
+                for r in result:
+                    if len(records) >= max_rows:
+                        truncated = True
+                        break
+                    records.append(_strip_vectors(r.data()))
+                # Tell the server to drop whatever was not read.
+                result.consume()
+            except Exception as e:
+                print(f"Cypher Execution Error: {e}")
+                return [], False
+        return records, truncated
+
+    def retrieve_graph(self, query_vec: list[float], k: int) -> list[dict]:
+        # State and themes come from the denormalized stateName/themeSummary
+        # properties written at ingest; older waivers fall back to traversal.
+        cypher = """
+        CALL db.index.vector.queryNodes('waiver_embeddings', $k, $vector)
+        YIELD node AS app, score
+
+        RETURN
+            app.applicationNumber AS waiver_id,
+            app.programTitle AS title,
+            CASE WHEN app.stateName IS NOT NULL THEN app.stateName
+                 ELSE COLLECT { MATCH (s:State)-[:HAS_APPLICATION]->(app) RETURN s.name }[0]
+            END AS state,
+            CASE WHEN app.themeSummary IS NOT NULL THEN app.themeSummary
+                 ELSE COLLECT {
+                     MATCH (app)-[:HAS_THEME]->(t:Theme)
+                     RETURN DISTINCT {type: "Theme", name: t.name, value: t.value}
+                 }
+            END AS themes,
+            score
+        ORDER BY score DESC
+        """
+        return self.run_query(cypher, {"vector": query_vec, "k": k}, max(k, 1))[0]
+
+    def similar_waivers(self, application_number: str, k: int) -> list[dict]:
+        cypher = """
+        MATCH (:WaiverApplication {applicationNumber: $id})-[r:SIMILAR_TO]->(app:WaiverApplication)
+        RETURN
+            app.applicationNumber AS waiver_id,
+            app.programTitle AS title,
+            app.stateName AS state,
+            app.themeSummary AS themes,
+            (1 + r.score) / 2.0 AS score  // SIMILAR_TO stores raw cosine
+        ORDER BY score DESC
+        LIMIT $k
+        """
+        return self.run_query(cypher, {"id": application_number, "k": k}, max(k, 1))[0]
+
+    def retrieve_themes(self, query_vec: list[float], k: int, state_name: Optional[str]) -> list[dict]:
+        # The vector index has no filter support, so over-fetch when a state
+        # filter will discard candidates afterwards.
+        fetch = k * 10 if state_name else k
+        cypher = """
+        CALL db.index.vector.queryNodes('theme_embeddings', $fetch, $vector)
+        YIELD node AS t, score
+
+        MATCH (s:State)-[:HAS_APPLICATION]->(w:WaiverApplication)-[:HAS_THEME]->(t)
+        WHERE $state IS NULL OR toLower(s.name) = toLower($state)
+
+        RETURN
+            t.name AS question,
+            t.value AS answer,
+            score,
+            collect(DISTINCT {
+                waiver_id: w.applicationNumber,
+                title: w.programTitle,
+                state: s.name
+            }) AS waivers
+        ORDER BY score DESC
+        LIMIT $k
+        """
+        with self.driver.session(database=config.NEO4J_DATABASE) as session:
+            try:
+                return session.run(
+                    cypher, vector=query_vec, fetch=fetch, k=k, state=state_name
+                ).data()
+            except Exception as e:
+                print(f"Cypher Execution Error: {e}")
+                return []
+
+    def explain(self, cypher: str, params: dict) -> dict:
+        with self.driver.session(database=config.NEO4J_DATABASE) as session:
+            summary = session.run(f"EXPLAIN {cypher}", **(params or {})).consume()
+
+        operators = []
+
+        def walk(step: dict, depth: int) -> None:
+            name = step.get("operatorType", "").split("@")[0]
+            rows = (step.get("arguments") or {}).get("EstimatedRows") or 0
+            operators.append({"operator": name, "estimated_rows": float(rows), "depth": depth})
+            for child in step.get("children") or []:
+                walk(child, depth + 1)
+
+        if summary.plan:
+            walk(summary.plan, 0)
+        return {
+            "operators": operators,
+            "estimated_rows": operators[0]["estimated_rows"] if operators else 0.0,
+            "max_estimated_rows": max((o["estimated_rows"] for o in operators), default=0.0),
+        }
+
+    def close(self) -> None:
+        self.driver.close()
+
+
+def _normalized(vectors: list, dims: int) -> np.ndarray:
+    matrix = np.zeros((len(vectors), dims), dtype=np.float32)
+    for i, v in enumerate(vectors):
+        if v is not None and len(v) == dims:
+            matrix[i] = v
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class InMemoryGraphBackend(GraphBackend):
+    """The waiver graph held in process: vector matrices plus adjacency dicts."""
+
+    def __init__(self, waivers: list[dict], themes: list[dict]):
+        """`waivers`: id, title, state, theme_keys, embedding. `themes`: key, name, value, embedding."""
+        dims = next((len(r["embedding"]) for r in [*waivers, *themes] if r.get("embedding") is not None), 0)
+        self.waiver_ids = [w["id"] for w in waivers]
+        self.titles = [w.get("title") or "" for w in waivers]
+        self.states = [w.get("state") or "" for w in waivers]
+        self.theme_keys = [t["key"] for t in themes]
+        self.theme_names = [t.get("name") or "" for t in themes]
+        self.theme_values = [t.get("value") or "" for t in themes]
+        self.waiver_vectors = _normalized([w.get("embedding") for w in waivers], dims)
+        self.theme_vectors = _normalized([t.get("embedding") for t in themes], dims)
+
+        self.waiver_index = {w: i for i, w in enumerate(self.waiver_ids)}
+        theme_index = {k: i for i, k in enumerate(self.theme_keys)}
+        self.waiver_themes: dict[int, list[int]] = {}
+        self.theme_waivers: dict[int, list[int]] = {}
+        for i, w in enumerate(waivers):
+            linked = [theme_index[k] for k in w.get("theme_keys", []) if k in theme_index]
+            self.waiver_themes[i] = linked
+            for t in linked:
+                self.theme_waivers.setdefault(t, []).append(i)
+
+    # --- Construction and persistence ---
+
+    @classmethod
+    def from_neo4j(cls, driver=None) -> "InMemoryGraphBackend":
+        own_driver = driver is None
+        driver = driver or GraphDatabase.driver(
+            config.NEO4J_URI, auth=(config.NEO4J_USER, config.NEO4J_PASSWORD)
+        )
+        try:
+            with driver.session(database=config.NEO4J_DATABASE) as session:
+                waivers = session.run(
+                    """
+                    MATCH (w:WaiverApplication)
+                    OPTIONAL MATCH (s:State)-[:HAS_APPLICATION]->(w)
+                    RETURN w.applicationNumber AS id, w.programTitle AS title,
+                           coalesce(w.stateName, s.name) AS state, w.embedding AS embedding,
+                           COLLECT { MATCH (w)-[:HAS_THEME]->(t:Theme) RETURN t.key } AS theme_keys
+                    """
+                ).data()
+                themes = session.run(
+                    "MATCH (t:Theme) RETURN t.key AS key, t.name AS name, t.value AS value, t.embedding AS embedding"
+                ).data()
+        finally:
+            if own_driver:
+                driver.close()
+        return cls(waivers, themes)
+
+    @classmethod
+    def from_statewise(cls, file_path: str, embedder, batch_size: int = 500) -> "InMemoryGraphBackend":
+        """Build straight from the spreadsheet, no database involved."""
+        import pandas as pd
+
+        from core.ingestion.graph_ingest import _batch_params, _prepare_rows
+
+        rows = _prepare_rows(pd.read_excel(file_path, dtype=str).fillna(""))
+        waivers, themes, seen = [], [], set()
+        for i in range(0, len(rows), batch_size):
+            row_params, theme_params = _batch_params(embedder, rows[i : i + batch_size], seen)
+            waivers += [
+                {
+                    "id": r["application_number"],
+                    "title": r["program_title"],
+                    "state": r["state"],
+                    "theme_keys": r["theme_keys"],
+                    "embedding": r["embedding"],
+                }
+                for r in row_params
+            ]
+            themes += theme_params
+        return cls(waivers, themes)
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lengths = [len(self.waiver_themes[i]) for i in range(len(self.waiver_ids))]
+        np.savez_compressed(
+            path,
+            waiver_ids=np.asarray(self.waiver_ids, dtype=str),
+            titles=np.asarray(self.titles, dtype=str),
+            states=np.asarray(self.states, dtype=str),
+            waiver_vectors=self.waiver_vectors,
+            theme_keys=np.asarray(self.theme_keys, dtype=str),
+            theme_names=np.asarray(self.theme_names, dtype=str),
+            theme_values=np.asarray(self.theme_values, dtype=str),
+            theme_vectors=self.theme_vectors,
+            theme_indptr=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            theme_indices=np.asarray(
+                [t for i in range(len(self.waiver_ids)) for t in self.waiver_themes[i]], dtype=np.int64
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "InMemoryGraphBackend":
+        with np.load(path, allow_pickle=False) as f:
+            keys = f["theme_keys"].tolist()
+            indptr, indices = f["theme_indptr"], f["theme_indices"]
+            themes = [
+                {"key": k, "name": n, "value": v, "embedding": e}
+                for k, n, v, e in zip(keys, f["theme_names"].tolist(), f["theme_values"].tolist(), f["theme_vectors"])
+            ]
+            waivers = [
+                {
+                    "id": w,
+                    "title": title,
+                    "state": state,
+                    "embedding": e,
+                    "theme_keys": [keys[t] for t in indices[indptr[i] : indptr[i + 1]]],
+                }
+                for i, (w, title, state, e) in enumerate(
+                    zip(f["waiver_ids"].tolist(), f["titles"].tolist(), f["states"].tolist(), f["waiver_vectors"])
+                )
+            ]
+        return cls(waivers, themes)
+
+    # --- Queries ---
+
+    @staticmethod
+    def _top(matrix: np.ndarray, query_vec, k: int, exclude: Optional[int] = None) -> tuple[np.ndarray, np.ndarray]:
+        if len(matrix) == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query_vec, dtype=np.float32)
+        if query.shape[0] != matrix.shape[1]:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # Same scale as Neo4j's cosine vector index: (1 + cos) / 2.
+        scores = (1.0 + matrix @ (query / (np.linalg.norm(query) or 1.0))) / 2.0
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(k, len(scores) - (exclude is not None))
+        top = np.argpartition(-scores, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    def _theme(self, t: int) -> dict:
+        return {"type": "Theme", "name": self.theme_names[t], "value": self.theme_values[t]}
+
+    def _record(self, w: int, score: float, themes: Optional[list[dict]] = None) -> dict:
+        return {
+            "waiver_id": self.waiver_ids[w],
+            "title": self.titles[w],
+            "state": self.states[w],
+            "themes": themes if themes is not None else [self._theme(t) for t in self.waiver_themes[w]],
+            "score": float(score),
+        }
+
+    def retrieve_graph(self, query_vec: list[float], k: int) -> list[dict]:
+        top, scores = self._top(self.waiver_vectors, query_vec, k)
+        return [self._record(w, s) for w, s in zip(top, scores)]
+
+    def similar_waivers(self, application_number: str, k: int) -> list[dict]:
+        w = self.waiver_index.get(application_number)
+        if w is None:
+            return []
+        top, scores = self._top(self.waiver_vectors, self.waiver_vectors[w], k, exclude=w)
+        return [self._record(i, s) for i, s in zip(top, scores)]
+
+    def retrieve_themes(self, query_vec: list[float], k: int, state_name: Optional[str]) -> list[dict]:
+        fetch = k * 10 if state_name else k
+        top, scores = self._top(self.theme_vectors, query_vec, fetch)
+        results = []
+        for t, score in zip(top, scores):
+            waivers = [
+                {"waiver_id": self.waiver_ids[w], "title": self.titles[w], "state": self.states[w]}
+                for w in self.theme_waivers.get(t, [])
+                if state_name is None or self.states[w].lower() == state_name.lower()
+            ]
+            if waivers:
+                results.append(
+                    {"question": self.theme_names[t], "answer": self.theme_values[t], "score": float(score), "waivers": waivers}
+                )
+            if len(results) >= k:
+                break
+        return results
+
+    def _themes_by_waiver(self, params: dict) -> list[dict]:
+        """Shared body of the state_topic and states_mentioning templates."""
+        states = {s.lower() for s in params.get("states") or []}
+        top, scores = self._top(self.theme_vectors, params["vector"], params["fetch"])
+        grouped: dict[int, dict[str, Any]] = {}
+        for t, score in zip(top, scores):
+            for w in self.theme_waivers.get(t, []):
+                if states and self.states[w].lower() not in states:
+                    continue
+                entry = grouped.setdefault(w, {"score": score, "themes": []})
+                entry["score"] = max(entry["score"], score)
+                if len(entry["themes"]) < 5:
+                    entry["themes"].append(self._theme(t))
+        ranked = sorted(grouped.items(), key=lambda item: -item[1]["score"])[: params["k"]]
+        return [self._record(w, entry["score"], entry["themes"]) for w, entry in ranked]
+
+    def run_query(self, cypher: str, params: dict, max_rows: int) -> tuple[list[dict], bool]:
+        name = cypher_templates.template_for(cypher)
+        if name not in ("state_topic", "states_mentioning"):
+            print("In-memory graph backend only runs the Cypher templates; returning no rows.")
+            return [], False
+        records = self._themes_by_waiver(params)
+        return records[:max_rows], len(records) > max_rows
+
+    def explain(self, cypher: str, params: dict) -> dict:
+        # Nothing to plan in-process; the cost guard sees an empty plan.
+        return {"operators": [], "estimated_rows": 0.0, "max_estimated_rows": 0.0}
+
+
+@lru_cache(maxsize=4)
+def _memory_backend(path: str, mtime_ns: int) -> InMemoryGraphBackend:
+    # Keyed on the file's mtime, so a refreshed snapshot is picked up on the next call.
+    return InMemoryGraphBackend.load(Path(path))
+
+
+def refresh_memory_snapshot(driver=None, force: bool = False) -> Optional[Path]:
+    """Re-snapshot Neo4j into GRAPH_MEMORY_PATH after ingestion.
+
+    Only when the in-memory backend is in use or a snapshot already exists,
+    unless `force`. Returns the path written, if any.
+    """
+    path = Path(config.GRAPH_MEMORY_PATH)
+    if not (force or path.exists() or config.GRAPH_BACKEND.lower() == "memory"):
+        return None
+    InMemoryGraphBackend.from_neo4j(driver).save(path)
+    return path
+
+
+def make_graph_backend(name: Optional[str] = None) -> GraphBackend:
+    """GRAPH_BACKEND="memory" loads (or snapshots once from Neo4j) GRAPH_MEMORY_PATH."""
+    name = (name or config.GRAPH_BACKEND).lower()
+    if name == "memory":
+        path = Path(config.GRAPH_MEMORY_PATH)
+        if not path.exists():
+            refresh_memory_snapshot(force=True)
+        return _memory_backend(str(path), os.stat(path).st_mtime_ns)
+    if name == "neo4j":
+        return Neo4jGraphBackend()
+    raise ValueError(f"Unknown graph backend: {name}")
@@ -8,18 +8,22 @@ from pathlib import Path
 from typing import Callable
 
 import lancedb as _lancedb
+import pyarrow as pa
 from langchain_community.vectorstores import LanceDB
 from langchain_core.documents import Document
 
 from core import config
+from core.rag.embedding_cache import query_embedder
+from core.storage.lance_index import ensure_vector_index, vector_search_arrow, vector_search_batch_arrow
 
-
-def _make_embedder(provider: str):
-    if provider.upper() == "OPENAI":
-        from langchain_openai import OpenAIEmbeddings
-        return OpenAIEmbeddings(model=config.OPENAI_EMBEDDING_MODEL)
-    from langchain_ollama import OllamaEmbeddings
-    return OllamaEmbeddings(model=config.OLLAMA_EMBEDDING_MODEL)
+# Flattened projection of a coded example; the vector column is never fetched.
+EXAMPLE_COLUMNS = {
+    "text": "text",
+    "code": "metadata.code",
+    "code_path": "metadata.code_path",
+    "document": "metadata.document",
+    "coder": "metadata.coder",
+}
 
 
 def load_segments(path: str | Path) -> list[dict]:
@@ -55,7 +59,7 @@ def build_index(
 ) -> int:
     """Embed all segments and store them in LanceDB. Returns segments indexed."""
     valid = [s for s in segments if s.get("text", "").strip()]
-    embedder = _make_embedder(provider)
+    embedder = query_embedder(provider)
 
     docs = [
         Document(
@@ -85,29 +89,79 @@ def build_index(
         if progress_callback:
             progress_callback(min(i + batch_size, len(docs)), len(docs))
 
+    if docs:
+        ensure_vector_index(store.get_table())
     return len(docs)
 
 
 def get_store(provider: str = "OLLAMA") -> LanceDB:
     """Return the LanceDB vector store for the coded_segments table."""
     return LanceDB(
-        embedding=_make_embedder(provider),
+        embedding=query_embedder(provider),
         uri=str(config.LANCE_DB_PATH),
         table_name="coded_segments",
     )
 
 
-def retrieve_examples(query: str, store: LanceDB, k: int = 5) -> list[dict]:
-    """Return k-nearest coded examples for a query span."""
-    results = store.similarity_search_with_score(query, k=k)
-    return [
-        {
-            "text": doc.page_content,
-            "code": doc.metadata.get("code", ""),
-            "code_path": doc.metadata.get("code_path", ""),
-            "document": doc.metadata.get("document", ""),
-            "coder": doc.metadata.get("coder", ""),
-            "score": float(score),
-        }
-        for doc, score in results
-    ]
+def retrieve_examples_arrow(
+    query: str,
+    store: LanceDB,
+    k: int = 5,
+    nprobes: int | None = None,
+    refine_factor: int | None = None,
+) -> pa.Table:
+    """k-nearest coded examples as an Arrow table (EXAMPLE_COLUMNS plus `score`).
+
+    Queries the lancedb table directly with the metadata fields flattened in
+    the projection, so no Document or per-row dict is built.
+    """
+    vector = store.embeddings.embed_query(query)
+    table = vector_search_arrow(store.get_table(), vector, k, nprobes, refine_factor, columns=EXAMPLE_COLUMNS)
+    return table.rename_columns([*EXAMPLE_COLUMNS, "score"])
+
+
+def retrieve_examples(
+    query: str,
+    store: LanceDB,
+    k: int = 5,
+    nprobes: int | None = None,
+    refine_factor: int | None = None,
+) -> list[dict]:
+    """Return k-nearest coded examples for a query span.
+
+    nprobes/refine_factor tune the ANN index once one exists (defaults from config).
+    """
+    return retrieve_examples_arrow(query, store, k, nprobes, refine_factor).to_pylist()
+
+
+def retrieve_examples_batch(
+    queries: list[str],
+    store: LanceDB,
+    k: int = 5,
+    nprobes: int | None = None,
+    refine_factor: int | None = None,
+    batch_size: int | None = None,
+    progress_callback: Callable[[int, int], None] | None = None,
+) -> list[list[dict]]:
+    """`retrieve_examples` for many spans: one list of examples per query, in order.
+
+    Texts are embedded batch_size at a time (default KB_RETRIEVAL_BATCH) and
+    each batch of vectors is searched in a single LanceDB call. Blank queries
+    get an empty list.
+    """
+    batch_size = batch_size or config.KB_RETRIEVAL_BATCH
+    results: list[list[dict]] = [[] for _ in queries]
+    positions = [i for i, q in enumerate(queries) if q and q.strip()]
+    table = store.get_table()
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start : start + batch_size]
+        vectors = store.embeddings.embed_documents([queries[i] for i in chunk])
+        hits = vector_search_batch_arrow(
+            table, vectors, k, nprobes, refine_factor, columns=EXAMPLE_COLUMNS
+        ).rename_columns(["query_index", *EXAMPLE_COLUMNS, "score"])
+        # Hits come back grouped by query but not in query order; re-sort by distance within each.
+        for row in sorted(hits.to_pylist(), key=lambda r: (r["query_index"], r["score"])):
+            results[chunk[row.pop("query_index")]].append(row)
+        if progress_callback:
+            progress_callback(min(start + batch_size, len(positions)), len(positions))
+    return results
@@ -1,46 +1,105 @@
 import json
-from typing import TypedDict, List, Dict, Any
+import re
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Annotated, TypedDict, List, Dict, Any, Optional
 
-from langgraph.graph import StateGraph, END
+from langgraph.graph import StateGraph, START, END
+from core import config
+from .context import pack_graph_context
+from .cypher_templates import route_question
+from .plan_cache import PlanCache
 from .retriever import GraphRetriever
 from .generator import GeneratorFactory, PromptPiece
 
+def _merge_timings(left: Dict[str, float], right: Dict[str, float]) -> Dict[str, float]:
+    return {**(left or {}), **(right or {})}
+
+
 # State Schema
 class RAGState(TypedDict):
     question: str
     execution_plan: str
     cypher_query: str
+    cypher_params: Dict[str, Any]
+    template: str
+    cache_hit: bool
+    question_vector: List[float]
+    prefetched_graph: Dict[str, Any]
     filters: Dict[str, Any]
     is_safe: bool
+    plan_summary: Dict[str, Any]
     graph_data: Dict[str, Any]
     answer: str
     error: str
+    # Embedding + vector prefetch running in the background during planning.
+    background: Optional[Future]
+    # Per-node wall time in ms; each node adds its own key.
+    timings: Annotated[Dict[str, float], _merge_timings]
+
+# LangGraph runs a step only once every branch of the previous one has
+# finished, so a parallel branch would still hold up `analyze`; the embedding
+# and prefetch run on this pool instead. It is shared because the Graph RAG
+# page builds a new pipeline for every question.
+_BACKGROUND = ThreadPoolExecutor(max_workers=4, thread_name_prefix="graph-prefetch")
+
 
 class GraphRAGPipeline:
-    def __init__(self):
-        self.retriever = GraphRetriever()
+    def __init__(self, retriever: GraphRetriever = None):
+        self.retriever = retriever or GraphRetriever()
         self.generator = GeneratorFactory()
-        
+        self.plan_cache = (
+            PlanCache(config.GRAPH_PLAN_CACHE_SIMILARITY) if config.GRAPH_PLAN_CACHE else None
+        )
+        self.background = _BACKGROUND
+
         # Two distinct workflows
         self.planning_app = self._build_planning_workflow()
         self.execution_app = self._build_execution_workflow()
 
+    def _timed(self, name: str, node):
+        def run(state: RAGState) -> RAGState:
+            start = time.perf_counter()
+            update = node(state) or {}
+            return {**update, "timings": {name: round((time.perf_counter() - start) * 1000, 1)}}
+        return run
+
     def _build_planning_workflow(self):
         workflow = StateGraph(RAGState)
-        workflow.add_node("analyze", self.analyze_query_node)
-        workflow.add_node("draft_cypher", self.draft_cypher_node)
-        workflow.add_node("validate", self.validate_safety_node)
+        nodes = {
+            "route": self.route_template_node,
+            "cache_lookup": self.cache_lookup_node,
+            "analyze": self.analyze_query_node,
+            "draft_cypher": self.draft_cypher_node,
+            "validate": self.validate_safety_node,
+            "cache_store": self.cache_store_node,
+        }
+        for name, node in nodes.items():
+            workflow.add_node(name, self._timed(name, node))
 
-        workflow.set_entry_point("analyze")
+        workflow.add_edge(START, "route")
+
+        # Template and cache hits are complete plans; only the rest reach the LLM.
+        workflow.add_conditional_edges(
+            "route",
+            lambda state: "matched" if state.get("template") else "unmatched",
+            {"matched": END, "unmatched": "cache_lookup"},
+        )
+        workflow.add_conditional_edges(
+            "cache_lookup",
+            lambda state: "hit" if state.get("cache_hit") else "miss",
+            {"hit": END, "miss": "analyze"},
+        )
         workflow.add_edge("analyze", "draft_cypher")
         workflow.add_edge("draft_cypher", "validate")
-        workflow.add_edge("validate", END)
+        workflow.add_edge("validate", "cache_store")
+        workflow.add_edge("cache_store", END)
         return workflow.compile()
 
     def _build_execution_workflow(self):
         workflow = StateGraph(RAGState)
-        workflow.add_node("execute_search", self.execute_search_node)
-        workflow.add_node("generate_answer", self.generate_answer_node)
+        workflow.add_node("execute_search", self._timed("execute_search", self.execute_search_node))
+        workflow.add_node("generate_answer", self._timed("generate_answer", self.generate_answer_node))
 
         workflow.set_entry_point("execute_search")
         workflow.add_edge("execute_search", "generate_answer")
@@ -48,6 +107,57 @@ class GraphRAGPipeline:
         return workflow.compile()
 
     # --- Planning Nodes ---
+    def route_template_node(self, state: RAGState) -> RAGState:
+        routed = route_question(state["question"])
+        if routed is None:
+            return {"template": ""}
+        return {**routed, "is_safe": True}
+
+    def embed_and_prefetch(self, question: str) -> dict:
+        """Question embedding and, with GRAPH_PREFETCH, the plain vector hits for it."""
+        timings = {}
+        start = time.perf_counter()
+        try:
+            vector = self.retriever.embed_query(question)
+        except Exception as e:
+            print(f"Question embedding failed: {e}")
+            vector = None
+        timings["embed_question"] = round((time.perf_counter() - start) * 1000, 1)
+        update = {"question_vector": vector, "prefetched_graph": {}, "timings": timings}
+        if config.GRAPH_PREFETCH and vector:
+            start = time.perf_counter()
+            try:
+                update["prefetched_graph"] = self.retriever.retrieve_graph(vector, k=10)
+            except Exception as e:
+                print(f"Vector prefetch failed: {e}")
+            timings["prefetch"] = round((time.perf_counter() - start) * 1000, 1)
+        return update
+
+    @staticmethod
+    def _question_vector(state: RAGState) -> Optional[List[float]]:
+        # Blocks on the background embedding only when a node actually needs it.
+        if state.get("question_vector") is not None:
+            return state["question_vector"]
+        background = state.get("background")
+        return background.result()["question_vector"] if background is not None else None
+
+    def cache_lookup_node(self, state: RAGState) -> RAGState:
+        if self.plan_cache is None:
+            return {"cache_hit": False}
+        cached = self.plan_cache.lookup_exact(state["question"])
+        # Only an exact miss with a similarity threshold waits on the background embedding.
+        if cached is None and self.plan_cache.similarity_threshold is not None:
+            vector = self._question_vector(state)
+            cached = self.plan_cache.lookup_similar(vector) if vector is not None else None
+        if cached is None:
+            return {"cache_hit": False}
+        return {**cached, "cache_hit": True, "is_safe": True}
+
+    def cache_store_node(self, state: RAGState) -> RAGState:
+        if self.plan_cache is not None and state.get("is_safe"):
+            self.plan_cache.store(state["question"], state, self._question_vector(state))
+        return {}
+
     def analyze_query_node(self, state: RAGState) -> RAGState:
         query = state["question"]
         prompt = [
@@ -70,8 +180,12 @@ class GraphRAGPipeline:
                 role="system",
                 content=(
                     "Write a READ-ONLY Cypher query for a Waiver Graph.\n"
-                    "Schema: (State)-[:HAS_APPLICATION]->(WaiverApplication)-[:HAS_THEME]->(Theme)\n"
-                    "WaiverApplication has index 'waiver_embeddings'.\n"
+                    "Schema: (State)-[:HAS_APPLICATION]->(WaiverApplication)-[:HAS_THEME]->(Theme)-[:ANSWERS]->(Question)\n"
+                    "Theme has 'name' (the question) and 'value' (the answer) and is shared by every waiver giving that answer; Question has 'name'.\n"
+                    "(WaiverApplication)-[:SIMILAR_TO {score}]->(WaiverApplication) links each waiver to its closest waivers; use it for 'similar to' questions.\n"
+                    "WaiverApplication has index 'waiver_embeddings'; Theme has index 'theme_embeddings'.\n"
+                    "WaiverApplication.stateName is its state and WaiverApplication.themeSummary holds all its themes; "
+                    "return those as state and themes instead of traversing when no filter needs the traversal.\n"
                     "IMPORTANT: If filtering by state, use 'WHERE toLower(s.name) CONTAINS ...'.\n"
                     "If concept search needed, use 'CALL db.index.vector.queryNodes(\"waiver_embeddings\", 10, $vector)'\n"
                     # --- FIXED SECTION START ---
@@ -93,7 +207,45 @@ class GraphRAGPipeline:
         for term in forbidden:
             if term in cypher:
                 return {"is_safe": False, "error": f"Forbidden keyword: {term}"}
-        return {"is_safe": True}
+        return self._cost_guard(state.get("cypher_query", ""))
+
+    def _cost_guard(self, cypher: str) -> dict:
+        """EXPLAIN the query and reject (or LIMIT) plans that would run too long."""
+        # EXPLAIN only plans, but the parameters still have to be bound.
+        params = {"vector": [0.0], "k": 10} if "$vector" in cypher else {}
+        try:
+            summary = self.retriever.explain(cypher, params)
+        except Exception as e:
+            return {"is_safe": False, "error": f"Query could not be planned: {e}", "plan_summary": {}}
+
+        bad_ops = sorted(
+            {o["operator"] for o in summary["operators"]} & set(config.GRAPH_FORBIDDEN_OPERATORS)
+        )
+        if bad_ops:
+            return {
+                "is_safe": False,
+                "error": f"Plan uses forbidden operator(s): {', '.join(bad_ops)}",
+                "plan_summary": summary,
+            }
+        if summary["max_estimated_rows"] > config.GRAPH_MAX_ESTIMATED_ROWS:
+            return {
+                "is_safe": False,
+                "error": (
+                    f"Plan estimates {summary['max_estimated_rows']:,.0f} rows "
+                    f"(limit {config.GRAPH_MAX_ESTIMATED_ROWS:,})"
+                ),
+                "plan_summary": summary,
+            }
+
+        # Large but affordable result sets are capped rather than rejected.
+        if summary["estimated_rows"] > config.GRAPH_MAX_ROWS and not re.search(
+            r"\bLIMIT\s+\S+\s*;?\s*$", cypher, re.IGNORECASE
+        ):
+            cypher = f"{cypher.rstrip().rstrip(';')}\nLIMIT {config.GRAPH_MAX_ROWS}"
+            summary = {**summary, "rewritten": f"appended LIMIT {config.GRAPH_MAX_ROWS}"}
+            return {"is_safe": True, "cypher_query": cypher, "plan_summary": summary}
+
+        return {"is_safe": True, "plan_summary": summary}
 
     # --- Execution Nodes ---
     def execute_search_node(self, state: RAGState) -> RAGState:
@@ -101,36 +253,88 @@ class GraphRAGPipeline:
             return {"graph_data": {}}
         
         cypher = state["cypher_query"]
-        params = {}
-        
-        # Inject embedding if required by generated cypher
+        params = dict(state.get("cypher_params") or {})
+
+        # Inject embedding if required by generated cypher, reusing the one
+        # computed during planning when available.
         if "$vector" in cypher:
-            params["vector"] = self.retriever.embed_query(state["question"])
-            params["k"] = 10
-            
+            params["vector"] = state.get("question_vector") or self.retriever.embed_query(state["question"])
+            params.setdefault("k", 10)
+
         results = self.retriever.execute_raw_cypher(cypher, params)
+        prefetched = state.get("prefetched_graph") or {}
+        if not results.get("nodes") and prefetched.get("nodes") and not self._is_filtered(state):
+            # The drafted query found nothing; fall back to the plain vector hits.
+            results = {**prefetched, "source": "vector_prefetch"}
         return {"graph_data": results}
 
+    @staticmethod
+    def _is_filtered(state: RAGState) -> bool:
+        """True if the plan narrows by state, year or the like.
+
+        The prefetched hits are unfiltered; standing them in for an empty
+        filtered result would answer with waivers the question excluded.
+        """
+        params = set(state.get("cypher_params") or {}) - {"vector", "k", "fetch"}
+        return bool(
+            state.get("template")
+            or any(state.get("filters", {}).values())
+            or params
+            or re.search(r"\bWHERE\b", state.get("cypher_query", ""), re.IGNORECASE)
+        )
+
     def generate_answer_node(self, state: RAGState) -> RAGState:
         graph = state["graph_data"]
         if not graph.get("nodes"):
             return {"answer": "I could not find relevant documents in the validated execution plan."}
-            
+
+        context = pack_graph_context(graph, config.GRAPH_CONTEXT_TOKENS)
         prompt = [
             PromptPiece(role="system", content="Answer using ONLY the provided graph data."),
-            PromptPiece(role="user", content=f"Data: {json.dumps(graph)}\nQuestion: {state['question']}")
+            PromptPiece(role="user", content=f"Data: {json.dumps(context)}\nQuestion: {state['question']}")
         ]
         return {"answer": self.generator.generate(prompt)}
 
     # --- API methods ---
     def plan(self, query: str) -> dict:
-        return self.planning_app.invoke({
-            "question": query, "filters": {}, "execution_plan": "", 
-            "cypher_query": "", "is_safe": False, "graph_data": {}, "answer": "", "error": ""
+        start = time.perf_counter()
+        # Started before the graph so it overlaps routing and the LLM planning calls.
+        background = self.background.submit(self.embed_and_prefetch, query)
+        result = self.planning_app.invoke({
+            "question": query, "filters": {}, "execution_plan": "",
+            "cypher_query": "", "cypher_params": {}, "template": "", "cache_hit": False,
+            "question_vector": None, "prefetched_graph": {}, "is_safe": False,
+            "plan_summary": {}, "graph_data": {}, "answer": "", "error": "",
+            "background": background, "timings": {}
         })
+        result.pop("background", None)
+        fetched = background.result()
+        result["question_vector"] = fetched["question_vector"]
+        result["prefetched_graph"] = fetched["prefetched_graph"]
+        result["timings"] = {
+            **result.get("timings", {}),
+            **fetched["timings"],
+            "plan_total": round((time.perf_counter() - start) * 1000, 1),
+        }
+        return result
 
-    def execute(self, cypher: str, question: str) -> dict:
-        return self.execution_app.invoke({
-            "question": question, "cypher_query": cypher, "is_safe": True,
-            "filters": {}, "execution_plan": "", "graph_data": {}, "answer": "", "error": ""
-        })
\ No newline at end of file
+    def execute(
+        self,
+        cypher: str,
+        question: str,
+        params: dict = None,
+        question_vector: list = None,
+        prefetched_graph: dict = None,
+        filters: dict = None,
+        template: str = None,
+    ) -> dict:
+        start = time.perf_counter()
+        result = self.execution_app.invoke({
+            "question": question, "cypher_query": cypher, "cypher_params": params or {},
+            "template": template or "", "cache_hit": False, "question_vector": question_vector,
+            "prefetched_graph": prefetched_graph or {}, "is_safe": True, "plan_summary": {},
+            "filters": filters or {}, "execution_plan": "", "graph_data": {}, "answer": "", "error": "",
+            "background": None, "timings": {}
+        })
+        result["timings"] = {**result.get("timings", {}), "execute_total": round((time.perf_counter() - start) * 1000, 1)}
+        return result
@@ -0,0 +1,103 @@
+"""Persistent cache of validated Graph RAG plans.
+
+Plans are keyed by the normalized question text and the graph schema
+version. When a similarity threshold is set, a question that misses the
+exact key can still reuse the plan of a near-identical cached question,
+but only a plan with no question-specific literals: "waivers in Ohio"
+must not be answered with the plan cached for "waivers in Texas".
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.storage import sqlite_storage
+from core.storage.graph_schema import schema_version
+
+# State fields that make up a reusable plan.
+PLAN_FIELDS = ("cypher_query", "cypher_params", "filters", "execution_plan", "plan_summary")
+# Parameters the pipeline fills in itself rather than from the question.
+GENERIC_PARAMS = {"vector", "k", "fetch"}
+
+_WHERE = re.compile(r"\bWHERE\b(.*?)(?=\b(?:RETURN|WITH|ORDER|LIMIT|MATCH|CALL)\b|$)", re.IGNORECASE | re.DOTALL)
+# Inline property maps in patterns, e.g. (s:State {name: 'Ohio'}).
+_PROPERTY_MAP = re.compile(r"\{[^{}]*\}")
+_STRING = re.compile(r"'[^']*'|\"[^\"]*\"")
+_NUMBER = re.compile(r"(?<![\w$.])\d+(?:\.\d+)?\b")
+
+
+def normalize_question(question: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", question.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def has_literals(plan: Dict[str, Any]) -> bool:
+    """True if the plan carries values taken from its question (state, year, ...)."""
+    if set(plan.get("cypher_params") or {}) - GENERIC_PARAMS:
+        return True
+    if any((plan.get("filters") or {}).values()):
+        return True
+    # Only WHERE clauses and property maps hold values from the question;
+    # procedure arguments such as queryNodes("waiver_embeddings", 10, $vector) do not.
+    cypher = plan.get("cypher_query") or ""
+    clauses = _WHERE.findall(cypher) + _PROPERTY_MAP.findall(cypher)
+    return any(_STRING.search(clause) or _NUMBER.search(clause) for clause in clauses)
+
+
+class PlanCache:
+    def __init__(self, similarity_threshold: Optional[float] = None):
+        self.similarity_threshold = similarity_threshold
+
+    def lookup(self, question: str, vector: Optional[List[float]] = None) -> Optional[Dict[str, Any]]:
+        plan = self.lookup_exact(question)
+        if plan is None and vector is not None:
+            plan = self.lookup_similar(vector)
+        return plan
+
+    def lookup_exact(self, question: str) -> Optional[Dict[str, Any]]:
+        version = schema_version()
+        key = normalize_question(question)
+        plan = sqlite_storage.get_cached_plan(key, version)
+        if plan is not None:
+            sqlite_storage.record_plan_cache_hit(key, version)
+        return plan
+
+    def lookup_similar(self, vector: List[float]) -> Optional[Dict[str, Any]]:
+        if self.similarity_threshold is None:
+            return None
+        version = schema_version()
+        key = self._nearest_key(vector, version)
+        plan = sqlite_storage.get_cached_plan(key, version) if key else None
+        # Entries stored before literal plans were kept out of the index.
+        if plan is None or has_literals(plan):
+            return None
+        sqlite_storage.record_plan_cache_hit(key, version)
+        return plan
+
+    def store(self, question: str, state: Dict[str, Any], vector: Optional[List[float]] = None) -> None:
+        plan = {field: state.get(field) for field in PLAN_FIELDS}
+        # Plans tied to the question's own literals are only reused on an exact match.
+        embedding = (
+            np.asarray(vector, dtype=np.float32).tobytes()
+            if vector is not None and not has_literals(plan)
+            else None
+        )
+        sqlite_storage.put_cached_plan(
+            normalize_question(question), schema_version(), question, plan, embedding
+        )
+
+    def _nearest_key(self, vector: List[float], version: str) -> Optional[str]:
+        query = np.asarray(vector, dtype=np.float32)
+        # Entries embedded with a different model have a different size; skip them.
+        entries = [
+            (key, blob)
+            for key, blob in sqlite_storage.list_cached_plan_embeddings(version)
+            if len(blob) == query.nbytes
+        ]
+        if not entries:
+            return None
+        matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in entries])
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+        scores = matrix @ query / np.where(norms == 0, 1.0, norms)
+        best = int(np.argmax(scores))
+        return entries[best][0] if scores[best] >= self.similarity_threshold else None
@@ -152,10 +152,13 @@ def predict_codes_dataframe(
 ) -> tuple[pd.DataFrame, dict]:
     """Run RAG coding on every row of df[text_column].
 
+    Examples for all rows are retrieved up front in batches (one embedding
+    request and one LanceDB search per batch) before the per-row Claude calls.
+
     Returns (results_df, total_usage_dict).
     results_df columns: id_column (if present), Row, Column, Code, Confidence, Rationale
     """
-    from core.rag.kb_indexer import retrieve_examples
+    from core.rag.kb_indexer import retrieve_examples_batch
 
     rows = []
     total_usage = {
@@ -167,14 +170,15 @@ def predict_codes_dataframe(
         "last_raw_response": "",
     }
 
-    for i, (idx, row) in enumerate(df.iterrows()):
-        text = str(row[text_column]) if pd.notna(row.get(text_column)) else ""
+    texts = [str(t) if pd.notna(t) else "" for t in df[text_column]]
+    all_examples = retrieve_examples_batch(texts, store, k=k)
+
+    for i, ((idx, row), text, examples) in enumerate(zip(df.iterrows(), texts, all_examples)):
         if not text.strip():
             if progress_callback:
                 progress_callback(i + 1, len(df))
             continue
 
-        examples = retrieve_examples(text, store, k=k)
         preds, usage = predict_codes(
             text=text,
             examples=examples,
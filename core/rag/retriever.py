@@ -1,68 +1,80 @@
-from neo4j import GraphDatabase
-
-from langchain_ollama import OllamaEmbeddings
-from langchain_openai import OpenAIEmbeddings
+import json
 
 from core import config
+from core.rag.embedding_cache import query_embedder
+from core.rag.graph_backend import GraphBackend, make_graph_backend
+
 
 class GraphRetriever:
-    def __init__(self):
-        self.driver = GraphDatabase.driver(
-            config.NEO4J_URI,
-            auth=(config.NEO4J_USER, config.NEO4J_PASSWORD)
-        )
-
-        if config.AI_PROVIDER.upper() == "OPENAI":
-            self.embedder = OpenAIEmbeddings(
-                model=config.OPENAI_EMBEDDING_MODEL
-            )
-        else:
-            self.embedder = OllamaEmbeddings(
-                model=config.OLLAMA_EMBEDDING_MODEL
-            )
+    def __init__(self, backend: GraphBackend = None, embedder=None):
+        # GRAPH_BACKEND picks Neo4j (default) or the in-process graph.
+        self.backend = backend or make_graph_backend()
+        self.embedder = embedder if embedder is not None else query_embedder()
 
     def embed_query(self, query: str) -> list[float]:
         return self.embedder.embed_query(query)
 
     def retrieve_graph(self, query_vec: list[float], k: int = 5) -> dict:
         """
-        Original method kept for compatibility.
+        Top-k waivers by vector similarity, with their state and themes.
+        """
+        return self._to_graph(self.backend.retrieve_graph(query_vec, k))
+
+    def similar_waivers(self, application_number: str, k: int = 10) -> dict:
+        """
+        Waivers most similar to the given one, read from the precomputed
+        SIMILAR_TO edges (no vector search).
+        """
+        return self._to_graph(self.backend.similar_waivers(application_number, k))
+
+    def retrieve_themes(self, query_vec: list[float], k: int = 10, state: str = None) -> list[dict]:
+        """
+        Top-k theme answers closest to the query, each with the waivers (and
+        their states) that gave that answer. `state` accepts a name or code.
+        """
+        state_name = None
+        if state:
+            codes = dict(config.US_STATES)
+            state_name = codes.get(state.upper(), state)
+        return self.backend.retrieve_themes(query_vec, k, state_name)
+
+    def explain(self, cypher: str, params: dict = None) -> dict:
         """
-        cypher = """
-        CALL db.index.vector.queryNodes('waiver_embeddings', $k, $vector)
-        YIELD node AS app, score
-
-        MATCH (s:State)-[:HAS_APPLICATION]->(app)
-        MATCH (app)-[:HAS_THEME]->(t:Theme)
-
-        RETURN
-            app.applicationNumber AS waiver_id,
-            app.programTitle AS title,
-            s.name AS state,
-            collect(DISTINCT {
-                type: "Theme",
-                name: t.name,
-                value: t.value
-            }) AS themes,
-            score
-        ORDER BY score DESC
+        Plan a query with EXPLAIN (nothing is executed) and summarize it as
+        a flat list of operators with their estimated rows.
         """
-        return self.execute_raw_cypher(cypher, {"vector": query_vec, "k": k})
+        return self.backend.explain(cypher, params or {})
 
-    def execute_raw_cypher(self, cypher: str, params: dict = None) -> dict:
+    def execute_raw_cypher(self, cypher: str, params: dict = None, max_rows: int = None) -> dict:
         """
         Executes a generated Cypher query safely.
+
+        At most `max_rows` (default GRAPH_MAX_ROWS) records are read;
+        embedding-like arrays are dropped from every record.
         """
         if params is None:
             params = {}
-            
-        with self.driver.session(database=config.NEO4J_DATABASE) as session:
+        if max_rows is None:
+            max_rows = config.GRAPH_MAX_ROWS
+        records, truncated = self.backend.run_query(cypher, params, max_rows)
+        return self._to_graph(records, truncated)
+
+    @staticmethod
+    def _themes(value) -> list:
+        if not value:
+            return []
+        if isinstance(value, str):
+            # Denormalized WaiverApplication.themeSummary is a JSON list; drafted
+            # Cypher can also return a plain string such as t.value.
             try:
-                records = [r.data() for r in session.run(cypher, **params)]
-            except Exception as e:
-                print(f"Cypher Execution Error: {e}")
-                return {"nodes": [], "edges": []}
-
+                decoded = json.loads(value)
+            except ValueError:
+                return [value]
+            return decoded if isinstance(decoded, list) else [value]
+        return value if isinstance(value, list) else [value]
+
+    @classmethod
+    def _to_graph(cls, records: list[dict], truncated: bool = False) -> dict:
         nodes = []
         edges = []
 
@@ -72,7 +84,7 @@ class GraphRetriever:
             wid = r.get("waiver_id") or r.get("app", {}).get("applicationNumber") or "unknown_id"
             title = r.get("title") or r.get("app", {}).get("programTitle") or "Untitled"
             state = r.get("state") or "Unknown State"
-            themes = r.get("themes") or []
+            themes = cls._themes(r.get("themes"))
             score = r.get("score") or 0
 
             # Only add node if ID is valid
@@ -102,8 +114,9 @@ class GraphRetriever:
 
         return {
             "nodes": nodes,
-            "edges": edges
+            "edges": edges,
+            "truncated": truncated,
         }
 
     def close(self):
-        self.driver.close()
+        self.backend.close()
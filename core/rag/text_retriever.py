@@ -1,33 +1,145 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from langchain_community.vectorstores import LanceDB
-from langchain_ollama import OllamaEmbeddings
-from langchain_openai import OpenAIEmbeddings
+import pyarrow as pa
 
 from core import config
+from core.rag.embedding_cache import query_embedder
+from core.storage.lance_index import (
+    fts_search,
+    metadata_filter,
+    open_table,
+    vector_search,
+    vector_search_arrow,
+)
+
+# What `search` reads back; the vector column is never fetched.
+RESULT_COLUMNS = ["id", "text", "metadata"]
+ARROW_COLUMNS = ["id", "text", "state", "doc_id", "page", "year"]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]], weights: List[float], rrf_k: int = 60
+) -> Dict[str, float]:
+    """Weighted RRF: each list adds weight / (rrf_k + rank) to the ids it ranks."""
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + weight / (rrf_k + rank)
+    return fused
+
 
 class TextRetriever:
     def __init__(self, provider: str):
-        if provider.upper() == "OPENAI":
-            self.embedder = OpenAIEmbeddings(model=config.OPENAI_EMBEDDING_MODEL)
-        else:
-            self.embedder = OllamaEmbeddings(model=config.OLLAMA_EMBEDDING_MODEL)
-
-        self.store = LanceDB(
-            embedding=self.embedder,
-            uri=str(config.LANCE_DB_PATH),
-            table_name="policy_docs",
-        )
+        self.embedder = query_embedder(provider)
+
+    @staticmethod
+    def table():
+        # Opened per call so newly ingested rows are visible.
+        return open_table("policy_docs")
+
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        nprobes: Optional[int] = None,
+        refine_factor: Optional[int] = None,
+        state: Optional[str] = None,
+        year: Optional[int] = None,
+        doc_ids: Optional[List[int]] = None,
+        mode: Optional[str] = None,
+        vector_weight: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Top-k chunks for `query`.
+
+        mode="vector": L2 nearest (score is the distance, lower is better);
+        nprobes/refine_factor tune the ANN index. mode="fts": BM25 (score is
+        BM25, higher is better). mode="hybrid" (default TEXT_SEARCH_MODE):
+        both lists fused with reciprocal rank fusion, the vector list weighted
+        by `vector_weight` and BM25 by 1 - vector_weight (score is the fused
+        RRF score, higher is better).
+
+        state (name or code), year and doc_ids are applied as a LanceDB prefilter
+        through the scalar indexes, so only matching rows are searched.
+        """
+        mode = (mode or config.TEXT_SEARCH_MODE).lower()
+        table = self.table()
+        where = metadata_filter(state, year, doc_ids)
 
-    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
-        results = self.store.similarity_search_with_score(query, k=k)
-        formatted = []
-        for doc, score in results:
-            formatted.append(
-                {
-                    "text": doc.page_content,
-                    "metadata": doc.metadata or {},
-                    "score": score,
-                }
+        if mode == "vector":
+            rows = vector_search(
+                table, self.embedder.embed_query(query), k, nprobes, refine_factor, where, RESULT_COLUMNS
             )
-        return formatted
+            return [self._format(row, row["_distance"]) for row in rows]
+
+        if mode == "fts":
+            rows = self._bm25(table, query, k, where)
+            if rows is None:
+                return self.search(query, k, nprobes, refine_factor, state, year, doc_ids, mode="vector")
+            return [self._format(row, row["_score"]) for row in rows]
+        if mode != "hybrid":
+            raise ValueError(f"Unknown search mode: {mode}")
+
+        weight = config.TEXT_HYBRID_VECTOR_WEIGHT if vector_weight is None else vector_weight
+        # Over-fetch each side so fusion has overlap to work with.
+        fetch = k * config.TEXT_HYBRID_CANDIDATES
+        by_vector = vector_search(
+            table, self.embedder.embed_query(query), fetch, nprobes, refine_factor, where, RESULT_COLUMNS
+        )
+        # Without an FTS index the vector list is fused alone, so `score` keeps
+        # its RRF meaning (higher is better).
+        by_bm25 = self._bm25(table, query, fetch, where) or []
+        rows = {row["id"]: row for row in by_bm25}
+        rows.update({row["id"]: row for row in by_vector})
+        fused = reciprocal_rank_fusion(
+            [[row["id"] for row in by_vector], [row["id"] for row in by_bm25]],
+            [weight, 1.0 - weight],
+            config.TEXT_RRF_K,
+        )
+        best = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [self._format(rows[key], fused[key]) for key in best]
+
+    def search_arrow(
+        self,
+        query: str,
+        k: int = 5,
+        nprobes: Optional[int] = None,
+        refine_factor: Optional[int] = None,
+        state: Optional[str] = None,
+        year: Optional[int] = None,
+        doc_ids: Optional[List[int]] = None,
+        columns: Optional[List[str]] = None,
+    ) -> pa.Table:
+        """Vector top-k as an Arrow table (ARROW_COLUMNS plus `_distance`).
+
+        For batch consumers: `.to_pandas()` gives a frame without building a
+        dict per hit. Hybrid fusion needs per-row ids, so it stays on `search`.
+        """
+        return vector_search_arrow(
+            self.table(),
+            self.embedder.embed_query(query),
+            k,
+            nprobes,
+            refine_factor,
+            metadata_filter(state, year, doc_ids),
+            columns or ARROW_COLUMNS,
+        )
+
+    @staticmethod
+    def _bm25(table, query: str, k: int, where: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        # The FTS index is built at ingest (pdf_ingest, lance_index.ensure_indexes);
+        # a table without one answers with None so the caller can use vectors only.
+        try:
+            return fts_search(table, query, k, where, columns=RESULT_COLUMNS)
+        except RuntimeError as e:
+            if "inverted index" not in str(e):
+                raise
+            print("policy_docs has no FTS index; using vector search. Run lance_index.ensure_indexes() to build it.")
+            return None
+
+    @staticmethod
+    def _format(row: Dict[str, Any], score: float) -> Dict[str, Any]:
+        return {
+            "text": row["text"],
+            "metadata": row.get("metadata") or {},
+            "score": score,
+        }
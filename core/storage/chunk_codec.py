@@ -0,0 +1,128 @@
+"""Compression codecs for chunk text stored in SQLite.
+
+Chunk text is stored as a compressed blob. The codec name and the optional
+shared dictionary id are kept in their own columns, so every row can be
+decoded on its own. zlib is always available; zstd is used when the
+optional `zstandard` package is installed.
+"""
+import zlib
+from collections import Counter
+from typing import Iterable, Optional
+
+try:
+    import zstandard as _zstd
+except ImportError:  # optional dependency
+    _zstd = None
+
+ZLIB_LEVEL = 9
+ZSTD_LEVEL = 19
+DEFAULT_DICT_SIZE = 32 * 1024  # zlib only looks back 32 KiB, zstd accepts larger
+
+
+def resolve_codec(name: str) -> str:
+    """Return the codec to actually use, falling back to zlib without zstandard."""
+    name = (name or "zlib").lower()
+    if name == "zstd" and _zstd is not None:
+        return "zstd"
+    return "zlib"
+
+
+def compress(text: str, codec: str = "zlib", dictionary: Optional[bytes] = None) -> bytes:
+    data = (text or "").encode("utf-8")
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("zstd codec requested but 'zstandard' is not installed.")
+        dict_data = _zstd.ZstdCompressionDict(dictionary) if dictionary else None
+        return _zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(data)
+    if dictionary:
+        comp = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, zlib.MAX_WBITS, zdict=dictionary)
+        return comp.compress(data) + comp.flush()
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress(blob: bytes, codec: str = "zlib", dictionary: Optional[bytes] = None) -> str:
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("Chunk was stored with zstd but 'zstandard' is not installed.")
+        dict_data = _zstd.ZstdCompressionDict(dictionary) if dictionary else None
+        return _zstd.ZstdDecompressor(dict_data=dict_data).decompress(blob).decode("utf-8")
+    if dictionary:
+        decomp = zlib.decompressobj(zlib.MAX_WBITS, zdict=dictionary)
+        return (decomp.decompress(blob) + decomp.flush()).decode("utf-8")
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def _boilerplate_dictionary(samples: list[str], dict_size: int) -> bytes:
+    # Lines repeated across many pages (form headers, CMS instructions, checkbox
+    # labels) are what waiver pages share; deflate favours matches near the end
+    # of the preset dictionary, so the most frequent lines go last.
+    counts: Counter = Counter()
+    for text in samples:
+        counts.update({line.strip() for line in text.splitlines() if len(line.strip()) > 8})
+
+    ranked = sorted(
+        (line for line, n in counts.items() if n > 1),
+        key=lambda line: counts[line] * len(line),
+        reverse=True,
+    )
+    picked: list[bytes] = []
+    used = 0
+    for line in ranked:
+        encoded = line.encode("utf-8") + b"\n"
+        if used + len(encoded) > dict_size:
+            continue
+        picked.append(encoded)
+        used += len(encoded)
+    return b"".join(reversed(picked))
+
+
+def train_dictionary(samples: Iterable[str], codec: str = "zlib", dict_size: int = DEFAULT_DICT_SIZE) -> bytes:
+    """Build a shared dictionary from sample chunk texts."""
+    samples = [s for s in samples if s]
+    if codec == "zstd" and _zstd is not None:
+        try:
+            return _zstd.train_dictionary(dict_size, [s.encode("utf-8") for s in samples]).as_bytes()
+        except Exception:
+            # Too few samples for the trainer; a raw-content dictionary still helps.
+            pass
+    return _boilerplate_dictionary(samples, min(dict_size, DEFAULT_DICT_SIZE) if codec == "zlib" else dict_size)
+
+
+class LazyText:
+    """Compressed chunk text that is only decompressed when first read."""
+
+    __slots__ = ("_blob", "_codec", "_dictionary", "_text")
+
+    def __init__(self, blob: bytes, codec: str, dictionary: Optional[bytes] = None):
+        self._blob = blob
+        self._codec = codec
+        self._dictionary = dictionary
+        self._text: Optional[str] = None
+
+    @property
+    def compressed_size(self) -> int:
+        return len(self._blob)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = decompress(self._blob, self._codec, self._dictionary)
+        return self._text
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, LazyText):
+            return self.text == other.text
+        return self.text == other
+
+    def __hash__(self) -> int:
+        return hash(self.text)
+
+    def __repr__(self) -> str:
+        state = "decoded" if self._text is not None else f"{len(self._blob)} bytes {self._codec}"
+        return f"LazyText({state})"
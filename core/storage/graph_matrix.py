@@ -0,0 +1,283 @@
+"""Sparse in-process copy of the state/waiver/theme graph for analytics.
+
+`load_graph_matrix` pulls waivers and their HAS_THEME edges out of Neo4j
+into a SciPy CSR waiver x theme incidence matrix plus id maps, and caches
+it as a compressed .npz keyed on a fingerprint of the graph. Co-occurrence,
+degree and PageRank are then sparse matrix products that take milliseconds,
+instead of Cypher aggregations over every Theme node.
+"""
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from neo4j import GraphDatabase
+from scipy import sparse
+
+from core import config
+from core.storage.graph_schema import schema_version
+
+
+class GraphMatrix:
+    """Waiver x theme incidence (CSR) with id maps for states, waivers and themes."""
+
+    def __init__(
+        self,
+        waiver_theme: sparse.csr_matrix,
+        waiver_ids: np.ndarray,
+        waiver_state: np.ndarray,
+        waiver_type: np.ndarray,
+        waiver_year: np.ndarray,
+        states: np.ndarray,
+        theme_keys: np.ndarray,
+        theme_names: np.ndarray,
+        theme_values: np.ndarray,
+        fingerprint: str = "",
+    ):
+        self.waiver_theme = waiver_theme.tocsr()
+        self.waiver_ids = waiver_ids
+        self.waiver_state = waiver_state  # index into `states` per waiver
+        self.waiver_type = waiver_type
+        self.waiver_year = waiver_year
+        self.states = states
+        self.theme_keys = theme_keys
+        self.theme_names = theme_names
+        self.theme_values = theme_values
+        self.fingerprint = fingerprint
+        self.waiver_index = {w: i for i, w in enumerate(waiver_ids)}
+        self.theme_index = {k: i for i, k in enumerate(theme_keys)}
+
+    @property
+    def state_waiver(self) -> sparse.csr_matrix:
+        n = len(self.waiver_ids)
+        return sparse.csr_matrix(
+            (np.ones(n, dtype=np.float32), (self.waiver_state, np.arange(n))),
+            shape=(len(self.states), n),
+        )
+
+    def theme_labels(self) -> np.ndarray:
+        return np.char.add(np.char.add(self.theme_names.astype(str), ": "), self.theme_values.astype(str))
+
+    def waiver_mask(self, state: Optional[str] = None, app_type: Optional[str] = None) -> np.ndarray:
+        mask = np.ones(len(self.waiver_ids), dtype=bool)
+        if state:
+            lowered = np.char.lower(self.states.astype(str))
+            mask &= np.isin(self.waiver_state, np.flatnonzero(lowered == state.lower()))
+        if app_type:
+            mask &= self.waiver_type == app_type
+        return mask
+
+    def save(self, path: Path) -> None:
+        m = self.waiver_theme
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path,
+            data=m.data,
+            indices=m.indices,
+            indptr=m.indptr,
+            shape=np.asarray(m.shape),
+            waiver_ids=self.waiver_ids,
+            waiver_state=self.waiver_state,
+            waiver_type=self.waiver_type,
+            waiver_year=self.waiver_year,
+            states=self.states,
+            theme_keys=self.theme_keys,
+            theme_names=self.theme_names,
+            theme_values=self.theme_values,
+            fingerprint=np.asarray(self.fingerprint),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "GraphMatrix":
+        with np.load(path, allow_pickle=False) as f:
+            matrix = sparse.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return cls(
+                matrix,
+                f["waiver_ids"],
+                f["waiver_state"],
+                f["waiver_type"],
+                f["waiver_year"],
+                f["states"],
+                f["theme_keys"],
+                f["theme_names"],
+                f["theme_values"],
+                fingerprint=str(f["fingerprint"]),
+            )
+
+
+def _driver():
+    return GraphDatabase.driver(
+        config.NEO4J_URI,
+        auth=(config.NEO4J_USER, config.NEO4J_PASSWORD),
+    )
+
+
+def graph_fingerprint(session) -> str:
+    """Cheap change detector: the schema version plus every waiver's content hash."""
+    row = session.run(
+        """
+        MATCH (w:WaiverApplication)
+        WITH w.applicationNumber + ':' + coalesce(w.contentHash, '') AS entry
+        ORDER BY entry
+        RETURN collect(entry) AS entries
+        """
+    ).single()
+    payload = "\n".join([schema_version(), *row["entries"]])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def export_graph_matrix(session) -> GraphMatrix:
+    waivers = pd.DataFrame(
+        session.run(
+            """
+            MATCH (w:WaiverApplication)
+            OPTIONAL MATCH (s:State)-[:HAS_APPLICATION]->(w)
+            RETURN w.applicationNumber AS id,
+                   coalesce(w.stateName, s.name, '') AS state,
+                   coalesce(w.applicationType, '') AS app_type,
+                   coalesce(w.year, '') AS year
+            ORDER BY id
+            """
+        ).data(),
+        columns=["id", "state", "app_type", "year"],
+    ).drop_duplicates("id")
+    themes = pd.DataFrame(
+        session.run(
+            "MATCH (t:Theme) RETURN t.key AS key, t.name AS name, t.value AS value ORDER BY key"
+        ).data(),
+        columns=["key", "name", "value"],
+    )
+    edges = pd.DataFrame(
+        session.run(
+            """
+            MATCH (w:WaiverApplication)-[:HAS_THEME]->(t:Theme)
+            RETURN w.applicationNumber AS waiver, t.key AS theme
+            """
+        ).data(),
+        columns=["waiver", "theme"],
+    )
+
+    states, state_codes = np.unique(waivers["state"].to_numpy(dtype=str), return_inverse=True)
+    rows = pd.Index(waivers["id"]).get_indexer(edges["waiver"])
+    cols = pd.Index(themes["key"]).get_indexer(edges["theme"])
+    keep = (rows >= 0) & (cols >= 0)
+    matrix = sparse.csr_matrix(
+        (np.ones(int(keep.sum()), dtype=np.float32), (rows[keep], cols[keep])),
+        shape=(len(waivers), len(themes)),
+    )
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+    return GraphMatrix(
+        matrix,
+        waivers["id"].to_numpy(dtype=str),
+        state_codes.astype(np.int32),
+        waivers["app_type"].to_numpy(dtype=str),
+        waivers["year"].to_numpy(dtype=str),
+        states,
+        themes["key"].to_numpy(dtype=str),
+        themes["name"].fillna("").to_numpy(dtype=str),
+        themes["value"].fillna("").to_numpy(dtype=str),
+    )
+
+
+def load_graph_matrix(path: Optional[Path] = None, refresh: bool = False, driver=None) -> GraphMatrix:
+    """Return the cached matrix, re-exporting from Neo4j if the graph changed."""
+    path = Path(path or config.GRAPH_MATRIX_PATH)
+    own_driver = driver is None
+    driver = driver or _driver()
+    try:
+        with driver.session(database=config.NEO4J_DATABASE) as session:
+            fingerprint = graph_fingerprint(session)
+            if not refresh and path.exists():
+                cached = GraphMatrix.load(path)
+                if cached.fingerprint == fingerprint:
+                    return cached
+            exported = export_graph_matrix(session)
+    finally:
+        if own_driver:
+            driver.close()
+    exported.fingerprint = fingerprint
+    exported.save(path)
+    return exported
+
+
+# --- Analytics ---
+
+def theme_cooccurrence(gm: GraphMatrix, mask: Optional[np.ndarray] = None) -> sparse.csr_matrix:
+    """Theme x theme counts of waivers (optionally only those in `mask`) sharing both."""
+    m = gm.waiver_theme if mask is None else gm.waiver_theme[mask]
+    return (m.T @ m).tocsr()
+
+
+def top_cooccurring(gm: GraphMatrix, state: Optional[str] = None, top: int = 20) -> pd.DataFrame:
+    co = sparse.triu(theme_cooccurrence(gm, gm.waiver_mask(state=state)), k=1).tocoo()
+    order = np.argsort(-co.data)[:top]
+    labels = gm.theme_labels()
+    return pd.DataFrame(
+        {
+            "theme_a": labels[co.row[order]],
+            "theme_b": labels[co.col[order]],
+            "waivers": co.data[order].astype(int),
+        }
+    )
+
+
+def degrees(gm: GraphMatrix) -> dict[str, pd.Series]:
+    """Themes per waiver, waivers per theme and waivers per state."""
+    m = gm.waiver_theme
+    return {
+        "waiver": pd.Series(np.asarray(m.sum(axis=1)).ravel(), index=gm.waiver_ids),
+        "theme": pd.Series(np.asarray(m.sum(axis=0)).ravel(), index=gm.theme_labels()),
+        "state": pd.Series(np.bincount(gm.waiver_state, minlength=len(gm.states)), index=gm.states),
+    }
+
+
+def theme_prevalence_difference(
+    gm: GraphMatrix, group_a: np.ndarray, group_b: np.ndarray, top: int = 20
+) -> pd.DataFrame:
+    """Themes whose share of waivers differs most between two waiver masks."""
+    m = gm.waiver_theme
+    share_a = np.asarray(m[group_a].mean(axis=0)).ravel() if group_a.any() else np.zeros(m.shape[1])
+    share_b = np.asarray(m[group_b].mean(axis=0)).ravel() if group_b.any() else np.zeros(m.shape[1])
+    diff = share_a - share_b
+    order = np.argsort(-np.abs(diff))[:top]
+    return pd.DataFrame(
+        {
+            "theme": gm.theme_labels()[order],
+            "share_a": share_a[order],
+            "share_b": share_b[order],
+            "difference": diff[order],
+        }
+    )
+
+
+def pagerank(gm: GraphMatrix, alpha: float = 0.85, tol: float = 1e-8, max_iter: int = 100) -> pd.DataFrame:
+    """PageRank over the undirected state-waiver-theme graph, by power iteration."""
+    sw, wt = gm.state_waiver, gm.waiver_theme
+    adjacency = sparse.bmat(
+        [[None, sw, None], [sw.T, None, wt], [None, wt.T, None]], format="csr"
+    ).astype(np.float64)
+    n = adjacency.shape[0]
+    if n == 0:
+        return pd.DataFrame(columns=["kind", "id", "rank"])
+    out_degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    inv = np.divide(1.0, out_degree, out=np.zeros(n), where=out_degree > 0)
+    transition = (sparse.diags(inv) @ adjacency).T.tocsr()
+    dangling = out_degree == 0
+
+    rank = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        new = alpha * (transition @ rank + rank[dangling].sum() / n) + (1 - alpha) / n
+        done = np.abs(new - rank).sum() < tol
+        rank = new
+        if done:
+            break
+
+    kinds = np.repeat(["state", "waiver", "theme"], [len(gm.states), len(gm.waiver_ids), len(gm.theme_keys)])
+    ids = np.concatenate([gm.states.astype(str), gm.waiver_ids.astype(str), gm.theme_labels()])
+    return (
+        pd.DataFrame({"kind": kinds, "id": ids, "rank": rank})
+        .sort_values("rank", ascending=False)
+        .reset_index(drop=True)
+    )
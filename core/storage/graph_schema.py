@@ -0,0 +1,153 @@
+"""Idempotent Neo4j schema bootstrap: constraints, lookup and vector indexes.
+
+Every MERGE in ingestion and document storage matches on one of the keys
+below; without a backing constraint each MERGE is a full label scan.
+"""
+import hashlib
+import json
+import time
+from typing import Optional
+
+from neo4j import GraphDatabase
+from neo4j.exceptions import ClientError
+
+from core import config
+
+# (name, label, property) — each creates a uniqueness constraint, which also
+# gives Neo4j an index to plan MERGE/MATCH lookups with.
+UNIQUE_CONSTRAINTS = [
+    ("country_name", "Country", "name"),
+    ("state_name", "State", "name"),
+    ("state_code", "State", "code"),
+    ("waiver_application_number", "WaiverApplication", "applicationNumber"),
+    ("document_doc_id", "Document", "doc_id"),
+    ("question_name", "Question", "name"),
+    ("theme_key", "Theme", "key"),
+]
+
+# (name, label, property) — plain range indexes for non-unique lookups and sorts.
+LOOKUP_INDEXES = [
+    ("document_updated_at", "Document", "updated_at"),
+    ("document_state", "Document", "state"),
+]
+
+# (name, label, properties) — Lucene full-text indexes.
+FULLTEXT_INDEXES = [
+    ("document_search", "Document", ["program_title", "state", "waiver_number", "doc_id"]),
+]
+
+# Bump when ingestion changes node labels, relationship types or properties
+# in a way that can break previously generated Cypher.
+SCHEMA_REVISION = 4
+
+_bootstrapped: set[tuple[str, str]] = set()
+
+
+def schema_version() -> str:
+    """Short fingerprint of the graph schema; cached Cypher plans are keyed on it."""
+    payload = json.dumps(
+        [SCHEMA_REVISION, UNIQUE_CONSTRAINTS, LOOKUP_INDEXES, FULLTEXT_INDEXES], sort_keys=True
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def _driver():
+    return GraphDatabase.driver(
+        config.NEO4J_URI,
+        auth=(config.NEO4J_USER, config.NEO4J_PASSWORD),
+    )
+
+
+def ensure_vector_index(session, name: str, label: str, prop: str, dims: int) -> None:
+    session.run(
+        f"""
+        CREATE VECTOR INDEX {name} IF NOT EXISTS
+        FOR (n:{label}) ON (n.{prop})
+        OPTIONS {{indexConfig: {{
+          `vector.dimensions`: {int(dims)},
+          `vector.similarity_function`: 'cosine'
+        }}}}
+        """
+    ).consume()
+
+
+def _create_constraints_and_indexes(session) -> None:
+    for name, label, prop in UNIQUE_CONSTRAINTS:
+        try:
+            session.run(
+                f"CREATE CONSTRAINT {name} IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.{prop} IS UNIQUE"
+            ).consume()
+        except ClientError as exc:
+            # Graphs written before the constraints existed can hold duplicates.
+            raise RuntimeError(
+                f"Cannot create constraint {name}: {label}.{prop} has duplicate values. "
+                "Re-ingest with mode='replace' to rebuild the graph."
+            ) from exc
+    for name, label, prop in LOOKUP_INDEXES:
+        session.run(f"CREATE INDEX {name} IF NOT EXISTS FOR (n:{label}) ON (n.{prop})").consume()
+    for name, label, props in FULLTEXT_INDEXES:
+        fields = ", ".join(f"n.{p}" for p in props)
+        session.run(
+            f"CREATE FULLTEXT INDEX {name} IF NOT EXISTS FOR (n:{label}) ON EACH [{fields}]"
+        ).consume()
+
+
+def _owned_index_names(vector_indexes) -> list[str]:
+    # A uniqueness constraint's backing index has the constraint's name.
+    return [
+        *(name for name, _, _ in UNIQUE_CONSTRAINTS),
+        *(name for name, _, _ in LOOKUP_INDEXES),
+        *(name for name, _, _ in FULLTEXT_INDEXES),
+        *(name for name, _, _, _ in vector_indexes or []),
+    ]
+
+
+def _verify_online(session, timeout_seconds: int, names: list[str]) -> list[dict]:
+    """Wait for the named indexes only; other indexes in the database are not ours to judge."""
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        rows = session.run(
+            "SHOW INDEXES YIELD name, type, state, populationPercent "
+            "WHERE name IN $names "
+            "RETURN name, type, state, populationPercent",
+            names=names,
+        ).data()
+        pending = [r for r in rows if r["state"] != "ONLINE"]
+        if not pending:
+            return rows
+        if any(r["state"] == "FAILED" for r in pending) or time.monotonic() >= deadline:
+            listed = ", ".join(f"{r['name']} ({r['state']})" for r in pending)
+            raise RuntimeError(f"Neo4j indexes not online: {listed}")
+        time.sleep(0.5)
+
+
+def ensure_graph_schema(
+    driver=None,
+    force: bool = False,
+    vector_indexes: Optional[list[tuple[str, str, str, int]]] = None,
+    timeout_seconds: int = 300,
+) -> dict:
+    """Create constraints and indexes if missing and wait until they are ONLINE.
+
+    Runs once per process per database unless `force` is set. `vector_indexes`
+    is a list of (name, label, property, dimensions) to create alongside.
+    """
+    key = (config.NEO4J_URI, config.NEO4J_DATABASE)
+    if key in _bootstrapped and not force and not vector_indexes:
+        return {"skipped": True}
+
+    own_driver = driver is None
+    driver = driver or _driver()
+    try:
+        with driver.session(database=config.NEO4J_DATABASE) as session:
+            _create_constraints_and_indexes(session)
+            for name, label, prop, dims in vector_indexes or []:
+                ensure_vector_index(session, name, label, prop, dims)
+            indexes = _verify_online(session, timeout_seconds, _owned_index_names(vector_indexes))
+    finally:
+        if own_driver:
+            driver.close()
+
+    _bootstrapped.add(key)
+    return {"skipped": False, "indexes": indexes}
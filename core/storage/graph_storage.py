@@ -1,9 +1,20 @@
+import re
+import time
 from datetime import datetime
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from neo4j import GraphDatabase
 
 from core import config
+from core.storage.graph_schema import ensure_graph_schema
+
+SAFE_SORT_FIELDS = {"updated_at", "uploaded_at", "state", "program_title", "waiver_number", "doc_id"}
+# Always set on upsert, so they can be compared raw and use the range index for ordering.
+_NON_NULL_SORT_FIELDS = {"updated_at", "doc_id"}
+_COUNT_TTL_SECONDS = 60
+_LUCENE_SPECIAL = re.compile(r'([+\-&|!(){}\[\]^"~*?:\\/])')
+
+_count_cache: Dict[Optional[str], Tuple[float, int]] = {}
 
 
 def _driver():
@@ -30,8 +41,27 @@ def upsert_document(doc_id: str, properties: Dict[str, Any]) -> None:
     )
     """
 
-    with _driver().session(database=config.NEO4J_DATABASE) as session:
+    driver = _driver()
+    ensure_graph_schema(driver)
+    with driver.session(database=config.NEO4J_DATABASE) as session:
         session.run(query, doc_id=doc_id, props=props, state=state)
+    _count_cache.clear()
+
+
+def _fulltext_query(search: str) -> str:
+    # Each whitespace-separated term must match as a prefix in one of the indexed fields.
+    terms = [_LUCENE_SPECIAL.sub(r"\\\1", t) for t in search.split() if t]
+    return " AND ".join(f"{t}*" for t in terms)
+
+
+def _match_clause(search: Optional[str]) -> Tuple[str, Dict[str, Any]]:
+    query = _fulltext_query(search) if search else ""
+    if not query:
+        return "MATCH (d:Document)", {}
+    return (
+        "CALL db.index.fulltext.queryNodes('document_search', $fulltext) YIELD node AS d",
+        {"fulltext": query},
+    )
 
 
 def list_documents(
@@ -40,28 +70,40 @@ def list_documents(
     search: Optional[str] = None,
     sort_by: str = "updated_at",
     sort_dir: str = "DESC",
+    after: Optional[Tuple[Any, str]] = None,
 ) -> List[Dict[str, Any]]:
-    skip = max(page - 1, 0) * page_size
-    safe_sort_fields = {"updated_at", "uploaded_at", "state", "program_title", "waiver_number", "doc_id"}
-    sort_field = sort_by if sort_by in safe_sort_fields else "updated_at"
+    """Return one page of documents.
+
+    Pass `after=document_cursor(previous_page, sort_by)` to page by keyset
+    (seek past the last row) instead of SKIP; `page` is then ignored.
+    """
+    sort_field = sort_by if sort_by in SAFE_SORT_FIELDS else "updated_at"
     direction = "ASC" if sort_dir.upper() == "ASC" else "DESC"
+    comparator = ">" if direction == "ASC" else "<"
+    sort_expr = f"d.{sort_field}" if sort_field in _NON_NULL_SORT_FIELDS else f"coalesce(d.{sort_field}, '')"
 
-    query = """
-    MATCH (d:Document)
-    WHERE $search IS NULL
-       OR toLower(d.program_title) CONTAINS toLower($search)
-       OR toLower(d.state) CONTAINS toLower($search)
-       OR toLower(d.waiver_number) CONTAINS toLower($search)
-       OR toLower(d.doc_id) CONTAINS toLower($search)
+    match, params = _match_clause(search)
+    if after is not None:
+        seek = f"""
+        WHERE {sort_expr} {comparator} $after_value
+           OR ({sort_expr} = $after_value AND d.doc_id {comparator} $after_id)
+        """
+        params.update(after_value=after[0], after_id=after[1], skip=0)
+    else:
+        seek = ""
+        params["skip"] = max(page - 1, 0) * page_size
+
+    query = f"""
+    {match}
+    {seek}
     RETURN d
-    ORDER BY d.__SORT_FIELD__ __SORT_DIR__
+    ORDER BY {sort_expr} {direction}, d.doc_id {direction}
     SKIP $skip
     LIMIT $limit
     """
-    query = query.replace("__SORT_FIELD__", sort_field).replace("__SORT_DIR__", direction)
 
     with _driver().session(database=config.NEO4J_DATABASE) as session:
-        rows = session.run(query, skip=skip, limit=page_size, search=search)
+        rows = session.run(query, limit=page_size, **params)
         results = []
         for row in rows:
             node = row["d"]
@@ -69,16 +111,32 @@ def list_documents(
         return results
 
 
+def document_cursor(rows: List[Dict[str, Any]], sort_by: str = "updated_at") -> Optional[Tuple[Any, str]]:
+    """Keyset cursor for the page after `rows`, or None when the page is empty."""
+    if not rows:
+        return None
+    sort_field = sort_by if sort_by in SAFE_SORT_FIELDS else "updated_at"
+    last = rows[-1]
+    value = last.get(sort_field)
+    if sort_field not in _NON_NULL_SORT_FIELDS and value is None:
+        value = ""
+    return value, last["doc_id"]
+
+
 def count_documents(search: Optional[str] = None) -> int:
-    query = """
-    MATCH (d:Document)
-    WHERE $search IS NULL
-       OR toLower(d.program_title) CONTAINS toLower($search)
-       OR toLower(d.state) CONTAINS toLower($search)
-       OR toLower(d.waiver_number) CONTAINS toLower($search)
-       OR toLower(d.doc_id) CONTAINS toLower($search)
+    """Count matching documents, cached for a short TTL and reset on upsert."""
+    key = _fulltext_query(search) if search else None
+    cached = _count_cache.get(key)
+    if cached and time.monotonic() - cached[0] < _COUNT_TTL_SECONDS:
+        return cached[1]
+
+    match, params = _match_clause(search)
+    query = f"""
+    {match}
     RETURN count(d) AS total
     """
     with _driver().session(database=config.NEO4J_DATABASE) as session:
-        row = session.run(query, search=search).single()
-        return int(row["total"] or 0)
+        row = session.run(query, **params).single()
+        total = int(row["total"] or 0)
+    _count_cache[key] = (time.monotonic(), total)
+    return total
@@ -0,0 +1,401 @@
+"""ANN index management and tuned vector search for the LanceDB tables.
+
+Without an index every search on `policy_docs` / `coded_segments` is a
+brute-force scan. `ensure_vector_index` builds an IVF-PQ (or IVF-HNSW)
+index once a table passes LANCE_INDEX_MIN_ROWS, folds small appends into
+it with `optimize()`, and retrains it from scratch once the unindexed share
+passes LANCE_INDEX_REBUILD_FRACTION. `vector_search` exposes nprobes and
+refine_factor, and `recall_latency_report` measures what they cost.
+
+Queries go straight to the lancedb tables (no LangChain Documents); pass
+`columns` to project only what the caller reads, and use the `_arrow`
+variants to hand an Arrow table to batch consumers.
+"""
+import math
+import time
+from typing import Callable, Optional
+
+import lancedb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from core import config
+
+VECTOR_COLUMN = "vector"
+TABLES = ("policy_docs", "coded_segments")
+
+# policy_docs metadata promoted to top-level columns so LanceDB can prefilter
+# on them through scalar indexes; `metadata` is kept for the LangChain reader.
+SCALAR_INDEXES = {
+    "state": "BITMAP",
+    "year": "BITMAP",
+    "doc_id": "BTREE",
+    "page": "BTREE",
+}
+
+
+def _connect():
+    return lancedb.connect(str(config.LANCE_DB_PATH))
+
+
+def open_table(name: str):
+    return _connect().open_table(name)
+
+
+def _project(query, columns, score_column: str):
+    # Name the score column explicitly so it survives the projection.
+    if columns is None:
+        return query
+    if isinstance(columns, dict):
+        return query.select({**columns, score_column: score_column})
+    return query.select([*columns, score_column])
+
+
+def _vector_index(table):
+    for index in table.list_indices():
+        if VECTOR_COLUMN in index.columns:
+            return index
+    return None
+
+
+def _dims(table) -> int:
+    return table.schema.field(VECTOR_COLUMN).type.list_size
+
+
+def _pq_sub_vectors(dims: int) -> int:
+    # ~16 dims per sub-vector; it must divide the dimension.
+    target = max(1, dims // 16)
+    for n in range(target, 0, -1):
+        if dims % n == 0:
+            return n
+    return 1
+
+
+def ensure_vector_index(table, force: bool = False, index_type: Optional[str] = None) -> dict:
+    """Create, extend or rebuild the ANN index on `table` as its size warrants."""
+    rows = table.count_rows()
+    index = _vector_index(table)
+    if rows < config.LANCE_INDEX_MIN_ROWS and not force:
+        return {"table": table.name, "rows": rows, "action": "none"}
+
+    if index is not None and not force:
+        stats = table.index_stats(index.name)
+        unindexed = stats.num_unindexed_rows if stats else rows
+        if unindexed == 0:
+            return {"table": table.name, "rows": rows, "action": "none"}
+        if unindexed / rows < config.LANCE_INDEX_REBUILD_FRACTION:
+            # Small delta: append the new rows to the existing partitions.
+            table.optimize()
+            return {"table": table.name, "rows": rows, "action": "optimized", "unindexed": unindexed}
+
+    index_type = (index_type or config.LANCE_INDEX_TYPE).upper()
+    dims = _dims(table)
+    start = time.perf_counter()
+    table.create_index(
+        metric="l2",  # LangChain's LanceDB store searches with L2
+        vector_column_name=VECTOR_COLUMN,
+        index_type=index_type,
+        num_partitions=max(1, int(math.sqrt(rows))),
+        num_sub_vectors=_pq_sub_vectors(dims) if index_type.endswith("PQ") else None,
+        replace=True,
+    )
+    return {
+        "table": table.name,
+        "rows": rows,
+        "action": "rebuilt" if index is not None else "created",
+        "index_type": index_type,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def policy_docs_schema(dims: int) -> pa.Schema:
+    return pa.schema(
+        [
+            pa.field(VECTOR_COLUMN, pa.list_(pa.float32(), dims)),
+            pa.field("id", pa.string()),
+            pa.field("text", pa.string()),
+            pa.field(
+                "metadata",
+                pa.struct(
+                    [
+                        pa.field("chunk_id", pa.int64()),
+                        pa.field("doc_id", pa.int64()),
+                        pa.field("state", pa.string()),
+                        pa.field("source_path", pa.string()),
+                        pa.field("page", pa.int64()),
+                    ]
+                ),
+            ),
+            pa.field("state", pa.string()),
+            pa.field("doc_id", pa.int64()),
+            pa.field("page", pa.int32()),
+            pa.field("year", pa.int32()),
+        ]
+    )
+
+
+def ensure_scalar_indexes(table) -> list[str]:
+    """Create missing scalar indexes on the promoted metadata columns; fold in new rows."""
+    names = set(table.schema.names)
+    indexed = {c for index in table.list_indices() for c in index.columns}
+    created = []
+    for column, index_type in SCALAR_INDEXES.items():
+        if column in names and column not in indexed:
+            table.create_scalar_index(column, index_type=index_type)
+            created.append(column)
+    stale = any(
+        (stats := table.index_stats(index.name)) and stats.num_unindexed_rows
+        for index in table.list_indices()
+        if index.columns[0] in SCALAR_INDEXES
+    )
+    if stale:
+        table.optimize()
+    return created
+
+
+def ensure_fts_index(table, column: str = "text") -> bool:
+    """Create the BM25 full-text index on `column` if missing; returns True if created.
+
+    No stemming, so waiver numbers, acronyms and citations match as written;
+    the vector side of hybrid search covers paraphrase.
+    """
+    if any(column in index.columns and index.index_type == "FTS" for index in table.list_indices()):
+        return False
+    table.create_fts_index(column, replace=True, stem=False)
+    return True
+
+
+def fts_search(
+    table,
+    query: str,
+    k: int,
+    where: Optional[str] = None,
+    column: str = "text",
+    columns: Optional[list[str] | dict[str, str]] = None,
+) -> list[dict]:
+    """k best rows by BM25 (`_score`, higher is better)."""
+    # Native FTS can drop the best hit under a very small limit (seen with
+    # many small fragments), so over-fetch and re-rank.
+    builder = table.search(query, query_type="fts", fts_columns=column).limit(max(4 * k, 20))
+    builder = _project(builder, columns, "_score")
+    if where:
+        builder = builder.where(where, prefilter=True)
+    rows = sorted(builder.to_list(), key=lambda row: row["_score"], reverse=True)
+    return rows[:k]
+
+
+def migrate_policy_docs_columns(years: Optional[dict[int, int]] = None) -> dict:
+    """Add the state/doc_id/page/year columns to a policy_docs table written before they existed.
+
+    state, doc_id and page are copied out of `metadata`; `years` maps doc_id
+    to year (defaults to the SQLite documents table).
+    """
+    table = _connect().open_table("policy_docs")
+    missing = {
+        "state": "metadata.state",
+        "doc_id": "metadata.doc_id",
+        "page": "CAST(metadata.page AS INT)",
+        "year": "CAST(NULL AS INT)",
+    }
+    missing = {k: v for k, v in missing.items() if k not in table.schema.names}
+    if missing:
+        table.add_columns(missing)
+    if years is None:
+        from core.storage.sqlite_storage import document_years
+
+        years = document_years()
+    by_year: dict[int, list[int]] = {}
+    for doc_id, year in years.items():
+        by_year.setdefault(int(year), []).append(int(doc_id))
+    for year, doc_ids in by_year.items():
+        table.update(where=f"doc_id IN ({', '.join(map(str, doc_ids))})", values={"year": year})
+    return {"added_columns": sorted(missing), "scalar_indexes": ensure_scalar_indexes(table)}
+
+
+def metadata_filter(
+    state: Optional[str] = None, year: Optional[int] = None, doc_ids: Optional[list[int]] = None
+) -> Optional[str]:
+    """SQL prefilter over the promoted columns. `state` accepts a name or a postal code."""
+    clauses = []
+    if state:
+        codes = {name.lower(): code for code, name in config.US_STATES}
+        code = codes.get(state.lower(), state.upper())
+        clauses.append(f"state = '{code.replace(chr(39), chr(39) * 2)}'")
+    if year:
+        clauses.append(f"year = {int(year)}")
+    if doc_ids:
+        clauses.append(f"doc_id IN ({', '.join(str(int(d)) for d in doc_ids)})")
+    return " AND ".join(clauses) or None
+
+
+def ensure_indexes(on_progress: Optional[Callable[[dict], None]] = None, force: bool = False) -> list[dict]:
+    """Run `ensure_vector_index` on every known table that exists."""
+    db = _connect()
+    results = []
+    for name in TABLES:
+        if name not in db.table_names():
+            continue
+        table = db.open_table(name)
+        result = ensure_vector_index(table, force=force)
+        if name == "policy_docs":
+            from core.storage.vector_quant import ensure_compact_index
+
+            result["scalar_indexes"] = ensure_scalar_indexes(table)
+            result["fts_created"] = ensure_fts_index(table)
+            result["compact"] = ensure_compact_index(name)
+        results.append(result)
+        if on_progress and result["action"] != "none":
+            on_progress({"event": "ann_index", **result})
+    return results
+
+
+def _vector_query(table, vector, k, nprobes, refine_factor, where, columns):
+    query = table.search(vector, vector_column_name=VECTOR_COLUMN).limit(k)
+    nprobes = nprobes or config.LANCE_NPROBES
+    refine_factor = refine_factor or config.LANCE_REFINE_FACTOR
+    if nprobes:
+        query = query.nprobes(nprobes)
+    if refine_factor:
+        query = query.refine_factor(refine_factor)
+    if where:
+        query = query.where(where, prefilter=True)
+    return _project(query, columns, "_distance")
+
+
+def vector_search(
+    table,
+    vector: list[float],
+    k: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    where: Optional[str] = None,
+    columns: Optional[list[str] | dict[str, str]] = None,
+) -> list[dict]:
+    """k nearest rows by L2. nprobes/refine_factor only matter once the table is indexed.
+
+    `columns` is a list of column names or a {name: SQL expression} dict
+    (e.g. {"code": "metadata.code"}); `_distance` is always included.
+    With VECTOR_COMPACT_DTYPE set, a current compact index on the table
+    answers instead (list projections only; see core.storage.vector_quant),
+    unless nprobes/refine_factor are given or the table has an ANN index.
+    Each row's `_search_path` says which answered: "compact" or "lance".
+    """
+    if (
+        config.VECTOR_COMPACT_DTYPE != "none"
+        and not isinstance(columns, dict)
+        and nprobes is None
+        and refine_factor is None
+        and _vector_index(table) is None
+    ):
+        from core.storage.vector_quant import compact_search
+
+        rows = compact_search(table, vector, k, where, columns)
+        if rows is not None:
+            return _mark_path(rows, "compact")
+    rows = _vector_query(table, vector, k, nprobes, refine_factor, where, columns).to_list()
+    return _mark_path(rows, "lance")
+
+
+def _mark_path(rows: list[dict], path: str) -> list[dict]:
+    for row in rows:
+        row["_search_path"] = path
+    return rows
+
+
+def vector_search_arrow(
+    table,
+    vector: list[float],
+    k: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    where: Optional[str] = None,
+    columns: Optional[list[str] | dict[str, str]] = None,
+) -> pa.Table:
+    """`vector_search` as an Arrow table; `.to_pandas()` on it avoids per-row dicts."""
+    return _vector_query(table, vector, k, nprobes, refine_factor, where, columns).to_arrow()
+
+
+def vector_search_batch_arrow(
+    table,
+    vectors: np.ndarray | list[list[float]],
+    k: int,
+    nprobes: Optional[int] = None,
+    refine_factor: Optional[int] = None,
+    where: Optional[str] = None,
+    columns: Optional[list[str] | dict[str, str]] = None,
+) -> pa.Table:
+    """k nearest rows for each of several query vectors in one LanceDB call.
+
+    Rows carry `query_index` (position in `vectors`) next to the projected
+    columns and `_distance`.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    result = _vector_query(table, vectors, k, nprobes, refine_factor, where, columns).to_arrow()
+    if "query_index" not in result.column_names:
+        # A single query vector comes back without the index column.
+        result = result.add_column(0, "query_index", pa.array(np.zeros(result.num_rows, dtype=np.int32)))
+    return result
+
+
+def recall_latency_report(
+    table_name: str = "policy_docs",
+    queries: int = 50,
+    k: int = 10,
+    nprobes_grid: tuple[int, ...] = (1, 5, 10, 20, 50),
+    refine_grid: tuple[Optional[int], ...] = (None, 5, 20),
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Recall@k and mean latency per (nprobes, refine_factor) against exact search.
+
+    Query vectors are sampled from the table itself; the exact top-k comes
+    from the same query with the index bypassed.
+    """
+    table = _connect().open_table(table_name)
+    vectors = table.to_lance().to_table(columns=[VECTOR_COLUMN]).column(VECTOR_COLUMN).to_numpy(
+        zero_copy_only=False
+    )
+    rng = np.random.default_rng(seed)
+    sample = [vectors[i] for i in rng.choice(len(vectors), size=min(queries, len(vectors)), replace=False)]
+
+    def ids(query) -> set:
+        return {row["_rowid"] for row in query.with_row_id(True).to_list()}
+
+    exact, exact_ms = [], []
+    for v in sample:
+        start = time.perf_counter()
+        exact.append(ids(table.search(v).limit(k).bypass_vector_index()))
+        exact_ms.append((time.perf_counter() - start) * 1000)
+
+    rows = [
+        {
+            "nprobes": None,
+            "refine_factor": None,
+            "recall_at_k": 1.0,
+            "mean_ms": float(np.mean(exact_ms)),
+            "p95_ms": float(np.percentile(exact_ms, 95)),
+        }
+    ]
+    if _vector_index(table) is None:
+        return pd.DataFrame(rows)
+    for nprobes in nprobes_grid:
+        for refine in refine_grid:
+            recalls, latencies = [], []
+            for v, truth in zip(sample, exact):
+                query = table.search(v).limit(k).nprobes(nprobes)
+                if refine:
+                    query = query.refine_factor(refine)
+                start = time.perf_counter()
+                found = ids(query)
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(found & truth) / max(len(truth), 1))
+            rows.append(
+                {
+                    "nprobes": nprobes,
+                    "refine_factor": refine,
+                    "recall_at_k": float(np.mean(recalls)),
+                    "mean_ms": float(np.mean(latencies)),
+                    "p95_ms": float(np.percentile(latencies, 95)),
+                }
+            )
+    return pd.DataFrame(rows)
@@ -1,51 +1,280 @@
+import atexit
 import json
+import queue
 import sqlite3
-from typing import Optional
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Callable, Optional
 
 from core import config
+from core.storage import chunk_codec
 
+# Keyed by (database path, dict_id): ids restart in a different SQLITE_PATH.
+_dictionary_cache: dict[tuple[str, int], tuple[str, bytes]] = {}
+_local = threading.local()
+_initialized: set[str] = set()
+_init_lock = threading.Lock()
 
-def _connect():
+
+def _open(isolation_level: Optional[str] = "DEFERRED") -> sqlite3.Connection:
     config.SQLITE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    return sqlite3.connect(config.SQLITE_PATH)
+    conn = sqlite3.connect(
+        config.SQLITE_PATH,
+        timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=isolation_level,
+        check_same_thread=False,
+    )
+    # WAL lets readers proceed while the writer thread holds the write lock.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+    return conn
 
 
-def init_db() -> None:
-    with _connect() as conn:
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                source_path TEXT,
-                stored_path TEXT,
-                state TEXT,
-                application_number TEXT,
-                program_title TEXT,
-                application_type TEXT,
-                approved_effective_date TEXT,
-                year INTEGER,
-                extra_json TEXT
-            )
-            """
+def _reader() -> sqlite3.Connection:
+    """Return this thread's read connection, reopening it if SQLITE_PATH changed."""
+    path = str(config.SQLITE_PATH)
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != path:
+        if conn is not None:
+            conn.close()
+        conn = _open()
+        _local.conn, _local.path = conn, path
+    return conn
+
+
+class _Writer:
+    """Single background thread that owns the only write connection.
+
+    Callers block on a future, so the public functions stay synchronous.
+    Writes that arrive while a transaction is running are drained from the
+    queue and committed together; each runs in its own savepoint so a
+    failing write does not roll back its neighbours.
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._path: Optional[str] = None
+
+    def submit(self, fn: Callable[[sqlite3.Connection], object], transactional: bool = True):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Nested SQLite write submitted from the writer thread.")
+        self._ensure_thread()
+        future: Future = Future()
+        self._queue.put((fn, future, transactional))
+        return future.result(timeout=config.SQLITE_WRITE_TIMEOUT_S)
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        path = str(config.SQLITE_PATH)
+        if self._conn is None or self._path != path:
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = _open(isolation_level=None)
+            self._path = path
+        return self._conn
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < config.SQLITE_WRITE_BATCH and batch[-1][2]:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                # A non-transactional item (e.g. VACUUM) always runs on its own.
+                if len(batch) > 1 and not batch[-1][2]:
+                    self._run_batch(batch[:-1])
+                    batch = batch[-1:]
+                if batch[0][2]:
+                    self._run_batch(batch)
+                else:
+                    self._run_single(*batch[0][:2])
+            except BaseException as exc:
+                # Never let one bad batch kill the thread every caller waits on.
+                self._fail(batch, exc)
+
+    @staticmethod
+    def _fail(batch, exc: BaseException) -> None:
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+    def _reset(self) -> None:
+        """Drop a connection left in an unknown transaction state."""
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("ROLLBACK")
+        except BaseException:
+            pass
+        try:
+            self._conn.close()
+        except BaseException:
+            pass
+        self._conn = None
+
+    def _run_single(self, fn, future: Future) -> None:
+        try:
+            future.set_result(fn(self._connection()))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    def _run_batch(self, batch) -> None:
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+        except BaseException as exc:
+            self._reset()
+            self._fail(batch, exc)
+            return
+
+        done = []
+        try:
+            for fn, future, _ in batch:
+                conn.execute("SAVEPOINT write_item")
+                try:
+                    result = fn(conn)
+                except BaseException as exc:
+                    conn.execute("ROLLBACK TO write_item")
+                    conn.execute("RELEASE write_item")
+                    future.set_exception(exc)
+                    continue
+                conn.execute("RELEASE write_item")
+                done.append((future, result))
+            conn.execute("COMMIT")
+        except BaseException as exc:
+            # A savepoint or the commit itself failed: nothing in the batch is kept.
+            self._reset()
+            self._fail(batch, exc)
+            return
+        for future, result in done:
+            future.set_result(result)
+
+
+_writer = _Writer()
+
+
+@atexit.register
+def _checkpoint() -> None:
+    """Fold the WAL back into the database file so a copy of app.db alone is complete."""
+    if str(config.SQLITE_PATH) not in _initialized:
+        return
+    try:
+        conn = _open(isolation_level=None)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def _ensure_chunk_columns(conn) -> None:
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+    for name, decl in (("text_z", "BLOB"), ("codec", "TEXT"), ("dict_id", "INTEGER")):
+        if name not in existing:
+            conn.execute(f"ALTER TABLE chunks ADD COLUMN {name} {decl}")
+
+
+def _create_schema(conn) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_path TEXT,
+            stored_path TEXT,
+            state TEXT,
+            application_number TEXT,
+            program_title TEXT,
+            application_type TEXT,
+            approved_effective_date TEXT,
+            year INTEGER,
+            extra_json TEXT
         )
-        conn.execute(
-            """
-            CREATE TABLE IF NOT EXISTS chunks (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                document_id INTEGER,
-                page INTEGER,
-                order_index INTEGER,
-                text TEXT
-            )
-            """
+        """
+    )
+    # `text` holds legacy uncompressed rows; new rows go to `text_z`.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            document_id INTEGER,
+            page INTEGER,
+            order_index INTEGER,
+            text TEXT,
+            text_z BLOB,
+            codec TEXT,
+            dict_id INTEGER
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chunk_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            codec TEXT,
+            created_at TEXT,
+            data BLOB
         )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS graph_plan_cache (
+            question_key TEXT,
+            schema_version TEXT,
+            question TEXT,
+            embedding BLOB,
+            plan_json TEXT,
+            created_at TEXT,
+            hits INTEGER DEFAULT 0,
+            PRIMARY KEY (question_key, schema_version)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS query_embeddings (
+            model_key TEXT,
+            text_hash TEXT,
+            embedding BLOB,
+            created_at TEXT,
+            PRIMARY KEY (model_key, text_hash)
+        )
+        """
+    )
+    _ensure_chunk_columns(conn)
+
+
+def init_db() -> None:
+    # Schema creation is a write; only queue it once per database file.
+    path = str(config.SQLITE_PATH)
+    if path in _initialized:
+        return
+    with _init_lock:
+        if path in _initialized:
+            return
+        _writer.submit(_create_schema)
+        _initialized.add(path)
 
 
 def clear_all() -> None:
-    with _connect() as conn:
+    def _clear(conn):
         conn.execute("DELETE FROM chunks")
         conn.execute("DELETE FROM documents")
 
+    _writer.submit(_clear)
+
 
 def insert_document(
     source_path: str,
@@ -58,7 +287,19 @@ def insert_document(
     year: Optional[int],
     extra: dict,
 ) -> int:
-    with _connect() as conn:
+    values = (
+        source_path,
+        stored_path,
+        state,
+        application_number,
+        program_title,
+        application_type,
+        approved_effective_date,
+        year,
+        json.dumps(extra or {}),
+    )
+
+    def _insert(conn):
         cursor = conn.execute(
             """
             INSERT INTO documents (
@@ -67,45 +308,354 @@ def insert_document(
                 year, extra_json
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            (
-                source_path,
-                stored_path,
-                state,
-                application_number,
-                program_title,
-                application_type,
-                approved_effective_date,
-                year,
-                json.dumps(extra or {}),
-            ),
+            values,
         )
         return int(cursor.lastrowid)
 
+    return _writer.submit(_insert)
+
+
+def _load_dictionary(conn, dict_id: Optional[int]) -> Optional[bytes]:
+    if dict_id is None:
+        return None
+    key = (str(config.SQLITE_PATH), dict_id)
+    if key not in _dictionary_cache:
+        row = conn.execute(
+            "SELECT codec, data FROM chunk_dictionaries WHERE id = ?", (dict_id,)
+        ).fetchone()
+        if row is None:
+            raise LookupError(f"Chunk dictionary {dict_id} is missing from the database.")
+        _dictionary_cache[key] = (row[0], bytes(row[1]))
+    return _dictionary_cache[key][1]
+
+
+def _current_dictionary(conn, codec: str) -> tuple[Optional[int], Optional[bytes]]:
+    row = conn.execute(
+        "SELECT id FROM chunk_dictionaries WHERE codec = ? ORDER BY id DESC LIMIT 1",
+        (codec,),
+    ).fetchone()
+    if row is None:
+        return None, None
+    return row[0], _load_dictionary(conn, row[0])
+
+
+def _encode_chunk(
+    text: str, codec: str, dict_id: Optional[int], dictionary: Optional[bytes]
+) -> tuple[bytes, str, Optional[int]]:
+    """(text_z, codec, dict_id) column values; resolve codec and dictionary once per batch."""
+    return chunk_codec.compress(text, codec, dictionary), codec, dict_id
+
+
+def _decode_chunk(conn, text, text_z, codec, dict_id):
+    if text_z is None:
+        return text
+    return chunk_codec.LazyText(bytes(text_z), codec or "zlib", _load_dictionary(conn, dict_id))
+
+
+def insert_chunks(document_id: int, chunks: list[tuple[str, int, int]]) -> list[int]:
+    """Insert (text, page, order_index) chunks in one write; returns their ids in order."""
+    init_db()
+    # Compress on the calling thread so the writer only does I/O.
+    codec = chunk_codec.resolve_codec(config.CHUNK_CODEC)
+    dict_id, dictionary = _current_dictionary(_reader(), codec)
+    rows = [
+        (document_id, page, order_index, *_encode_chunk(text, codec, dict_id, dictionary))
+        for text, page, order_index in chunks
+    ]
+
+    def _insert(conn):
+        ids = []
+        for row in rows:
+            cursor = conn.execute(
+                """
+                INSERT INTO chunks (document_id, page, order_index, text_z, codec, dict_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                row,
+            )
+            ids.append(int(cursor.lastrowid))
+        return ids
+
+    return _writer.submit(_insert)
+
 
 def insert_chunk(document_id: int, text: str, page: int, order_index: int) -> int:
-    with _connect() as conn:
+    return insert_chunks(document_id, [(text, page, order_index)])[0]
+
+
+def get_chunk_text(chunk_id: int) -> Optional[str]:
+    init_db()
+    conn = _reader()
+    row = conn.execute(
+        "SELECT text, text_z, codec, dict_id FROM chunks WHERE id = ?", (chunk_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    value = _decode_chunk(conn, *row)
+    return str(value) if value is not None else None
+
+
+def list_chunks(document_id: int) -> list[dict]:
+    """Return a document's chunks; `text` is decompressed only when read."""
+    init_db()
+    conn = _reader()
+    rows = conn.execute(
+        """
+        SELECT id, page, order_index, text, text_z, codec, dict_id
+        FROM chunks
+        WHERE document_id = ?
+        ORDER BY order_index
+        """,
+        (document_id,),
+    ).fetchall()
+    return [
+        {
+            "id": r[0],
+            "page": r[1],
+            "order_index": r[2],
+            "text": _decode_chunk(conn, *r[3:]),
+        }
+        for r in rows
+    ]
+
+
+def _sample_chunk_texts(conn, sample_size: int) -> list[str]:
+    rows = conn.execute(
+        """
+        SELECT text, text_z, codec, dict_id FROM chunks
+        ORDER BY RANDOM()
+        LIMIT ?
+        """,
+        (sample_size,),
+    ).fetchall()
+    return [str(_decode_chunk(conn, *r) or "") for r in rows]
+
+
+def train_chunk_dictionary(
+    sample_size: int = 1000,
+    dict_size: int = chunk_codec.DEFAULT_DICT_SIZE,
+    codec: Optional[str] = None,
+) -> Optional[int]:
+    """Train a shared dictionary on stored chunks; new inserts will use it.
+
+    Existing rows keep their old dictionary; run `migrate_compress_chunks(recompress=True)`
+    to re-encode them. Returns the new dictionary id, or None if there is nothing to train on.
+    """
+    init_db()
+    codec = chunk_codec.resolve_codec(codec or config.CHUNK_CODEC)
+    samples = _sample_chunk_texts(_reader(), sample_size)
+    data = chunk_codec.train_dictionary(samples, codec, dict_size)
+    if not data:
+        return None
+
+    def _insert(conn):
         cursor = conn.execute(
-            """
-            INSERT INTO chunks (document_id, page, order_index, text)
-            VALUES (?, ?, ?, ?)
-            """,
-            (document_id, page, order_index, text),
+            "INSERT INTO chunk_dictionaries (codec, created_at, data) VALUES (?, ?, ?)",
+            (codec, datetime.now(timezone.utc).isoformat(), data),
         )
         return int(cursor.lastrowid)
 
+    return _writer.submit(_insert)
 
-def list_recent_documents(limit: int = 25) -> list[dict]:
+
+def migrate_compress_chunks(
+    batch_size: int = 500,
+    recompress: bool = False,
+    vacuum: bool = True,
+    on_progress=None,
+) -> dict:
+    """Compress legacy plain-text chunk rows in batches.
+
+    With `recompress=True`, already-compressed rows that do not use the current
+    codec/dictionary are re-encoded too. `vacuum` returns freed pages to the OS.
+    """
     init_db()
-    with _connect() as conn:
+    converted = 0
+    last_id = 0
+    conn = _reader()
+    codec = chunk_codec.resolve_codec(config.CHUNK_CODEC)
+    current_dict_id, dictionary = _current_dictionary(conn, codec)
+    while True:
         rows = conn.execute(
             """
-            SELECT id, stored_path, state, application_number, program_title, year
-            FROM documents
-            ORDER BY id DESC
+            SELECT id, text, text_z, codec, dict_id FROM chunks
+            WHERE id > ?
+              AND (text_z IS NULL
+                   OR (? AND (codec IS NOT ? OR dict_id IS NOT ?)))
+            ORDER BY id
             LIMIT ?
             """,
-            (limit,),
+            (last_id, int(recompress), codec, current_dict_id, batch_size),
         ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for chunk_id, text, text_z, old_codec, old_dict in rows:
+            plain = str(_decode_chunk(conn, text, text_z, old_codec, old_dict) or "")
+            blob, new_codec, dict_id = _encode_chunk(plain, codec, current_dict_id, dictionary)
+            updates.append((blob, new_codec, dict_id, chunk_id))
+        _writer.submit(
+            lambda w: w.executemany(
+                "UPDATE chunks SET text = NULL, text_z = ?, codec = ?, dict_id = ? WHERE id = ?",
+                updates,
+            )
+        )
+        converted += len(updates)
+        last_id = rows[-1][0]
+        if on_progress:
+            on_progress({"event": "chunks_compressed", "converted": converted})
+
+    if vacuum and converted:
+        _writer.submit(lambda w: w.execute("VACUUM"), transactional=False)
+    return {"converted": converted, "codec": codec, "dict_id": current_dict_id}
+
+
+def benchmark_chunk_storage(sample_size: int = 500, repeats: int = 3) -> dict:
+    """Report size ratio and read latency of compressed vs. uncompressed chunk text.
+
+    The "uncompressed" baseline is the UTF-8 text as a TEXT column stores it;
+    its read cost is the decode to str. Each codec variant's
+    `read_vs_uncompressed` is its read latency relative to that baseline.
+    """
+    init_db()
+    conn = _reader()
+    samples = _sample_chunk_texts(conn, sample_size)
+    codec = chunk_codec.resolve_codec(config.CHUNK_CODEC)
+    dict_id, dictionary = _current_dictionary(conn, codec)
+    if not samples:
+        return {"samples": 0}
+
+    raw = [s.encode("utf-8") for s in samples]
+    raw_bytes = sum(len(b) for b in raw)
+    variants = {"plain": None}
+    if dictionary:
+        variants["dictionary"] = dictionary
+
+    def read_us(blobs: list[bytes], read) -> float:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for blob in blobs:
+                read(blob)
+        return (time.perf_counter() - start) / (repeats * len(blobs)) * 1e6
+
+    baseline_us = read_us(raw, lambda blob: blob.decode("utf-8"))
+    report = {
+        "samples": len(samples),
+        "codec": codec,
+        "dict_id": dict_id,
+        "raw_bytes": raw_bytes,
+        "uncompressed": {"stored_bytes": raw_bytes, "ratio": 1.0, "read_us_per_chunk": round(baseline_us, 2)},
+    }
+    for label, dict_data in variants.items():
+        blobs = [chunk_codec.compress(s, codec, dict_data) for s in samples]
+        stored = sum(len(b) for b in blobs)
+        elapsed_us = read_us(blobs, lambda blob: chunk_codec.decompress(blob, codec, dict_data))
+        report[label] = {
+            "stored_bytes": stored,
+            "ratio": round(raw_bytes / stored, 2) if stored else None,
+            "read_us_per_chunk": round(elapsed_us, 1),
+            "read_vs_uncompressed": round(elapsed_us / baseline_us, 1) if baseline_us else None,
+        }
+    return report
+
+
+def get_cached_plan(question_key: str, schema_version: str) -> Optional[dict]:
+    init_db()
+    row = _reader().execute(
+        "SELECT plan_json FROM graph_plan_cache WHERE question_key = ? AND schema_version = ?",
+        (question_key, schema_version),
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def list_cached_plan_embeddings(schema_version: str) -> list[tuple[str, bytes]]:
+    """(question_key, embedding) for every cached plan of this schema version that has one."""
+    init_db()
+    rows = _reader().execute(
+        """
+        SELECT question_key, embedding FROM graph_plan_cache
+        WHERE schema_version = ? AND embedding IS NOT NULL
+        """,
+        (schema_version,),
+    ).fetchall()
+    return [(r[0], bytes(r[1])) for r in rows]
+
+
+def put_cached_plan(
+    question_key: str,
+    schema_version: str,
+    question: str,
+    plan: dict,
+    embedding: Optional[bytes] = None,
+) -> None:
+    """Store a validated plan; entries from other schema versions are dropped."""
+    init_db()
+    values = (
+        question_key,
+        schema_version,
+        question,
+        embedding,
+        json.dumps(plan, default=str),
+        datetime.now(timezone.utc).isoformat(),
+    )
+
+    def _put(conn):
+        conn.execute("DELETE FROM graph_plan_cache WHERE schema_version <> ?", (schema_version,))
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO graph_plan_cache (
+                question_key, schema_version, question, embedding, plan_json, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            values,
+        )
+
+    _writer.submit(_put)
+
+
+def record_plan_cache_hit(question_key: str, schema_version: str) -> None:
+    _writer.submit(
+        lambda conn: conn.execute(
+            "UPDATE graph_plan_cache SET hits = hits + 1 WHERE question_key = ? AND schema_version = ?",
+            (question_key, schema_version),
+        )
+    )
+
+
+def get_query_embedding(model_key: str, text_hash: str) -> Optional[bytes]:
+    init_db()
+    row = _reader().execute(
+        "SELECT embedding FROM query_embeddings WHERE model_key = ? AND text_hash = ?",
+        (model_key, text_hash),
+    ).fetchone()
+    return bytes(row[0]) if row else None
+
+
+def put_query_embedding(model_key: str, text_hash: str, embedding: bytes) -> None:
+    init_db()
+    values = (model_key, text_hash, embedding, datetime.now(timezone.utc).isoformat())
+    _writer.submit(
+        lambda conn: conn.execute(
+            """
+            INSERT OR REPLACE INTO query_embeddings (model_key, text_hash, embedding, created_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            values,
+        )
+    )
+
+
+def list_recent_documents(limit: int = 25) -> list[dict]:
+    init_db()
+    rows = _reader().execute(
+        """
+        SELECT id, stored_path, state, application_number, program_title, year
+        FROM documents
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
     return [
         {
             "id": r[0],
@@ -117,3 +667,10 @@ def list_recent_documents(limit: int = 25) -> list[dict]:
         }
         for r in rows
     ]
+
+
+def document_years() -> dict[int, int]:
+    """Map of document id to approval year, for documents that have one."""
+    init_db()
+    rows = _reader().execute("SELECT id, year FROM documents WHERE year IS NOT NULL").fetchall()
+    return {r[0]: r[1] for r in rows}
@@ -0,0 +1,344 @@
+"""Compact float16 / int8 copy of a LanceDB vector column, with exact rescoring.
+
+bge-m3 stores 1024 float32s (4 KB) per page in `policy_docs`, and a flat
+search reads all of them. `CompactVectorIndex` keeps the vectors as float16
+or per-dimension int8 codes (2 KB / 1 KB, less again with PCA) in an .npz
+under VECTOR_COMPACT_DIR. A search scans the codes for the k * rescore best
+candidates, reads only those rows' float32 vectors back from LanceDB and
+re-ranks them exactly, so `_distance` is the same squared L2 LanceDB reports.
+
+This is an in-memory search accelerator, not a storage saving: the float32
+column stays in `policy_docs` for rescoring, so the codes are disk added on
+top of it (under LANCE_DB_PATH by default). What shrinks is the data a
+search scans.
+
+The index is tied to the table version it was built from; `compact_search`
+falls back to the regular LanceDB search while it is stale, and
+`ensure_compact_index` (run after ingestion) rebuilds it.
+`benchmark_quantization` reports size, latency and recall@k per setting.
+"""
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from core import config
+from core.storage.lance_index import VECTOR_COLUMN, open_table
+
+DTYPES = ("float16", "int8")
+_BLOCK_ROWS = 65536
+_FIT_SAMPLE = 20000
+
+_loaded: dict[str, "CompactVectorIndex"] = {}
+
+
+class VectorQuantizer:
+    """Centre, optionally PCA-project, then store as float16 or int8 codes."""
+
+    def __init__(
+        self,
+        dtype: str,
+        mean: np.ndarray,
+        components: Optional[np.ndarray] = None,
+        scale: Optional[np.ndarray] = None,
+    ):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported compact dtype: {dtype}")
+        self.dtype = dtype
+        self.mean = mean.astype(np.float32)
+        self.components = components  # (pca_dims, dims) or None
+        self.scale = scale  # per-dimension int8 step, or None for float16
+
+    @classmethod
+    def fit(cls, sample: np.ndarray, dtype: str = "int8", pca_dims: int = 0) -> "VectorQuantizer":
+        sample = np.asarray(sample, dtype=np.float32)
+        mean = sample.mean(axis=0)
+        centred = sample - mean
+        components = None
+        if pca_dims and pca_dims < sample.shape[1]:
+            _, _, vt = np.linalg.svd(centred, full_matrices=False)
+            components = vt[:pca_dims].astype(np.float32)
+        quantizer = cls(dtype, mean, components)
+        if dtype == "int8":
+            peak = np.abs(quantizer.project(sample)).max(axis=0)
+            quantizer.scale = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+        return quantizer
+
+    @property
+    def dims(self) -> int:
+        return len(self.mean) if self.components is None else len(self.components)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        centred = np.asarray(vectors, dtype=np.float32) - self.mean
+        return centred if self.components is None else centred @ self.components.T
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        projected = self.project(vectors)
+        if self.dtype == "float16":
+            return projected.astype(np.float16)
+        return np.clip(np.rint(projected / self.scale), -127, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        decoded = codes.astype(np.float32)
+        return decoded if self.scale is None else decoded * self.scale
+
+
+class CompactVectorIndex:
+    def __init__(
+        self,
+        quantizer: VectorQuantizer,
+        codes: np.ndarray,
+        ids: np.ndarray,
+        version: int,
+        table_name: str,
+    ):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.ids = ids  # the table's `id` column, in scan order
+        self.version = version
+        self.table_name = table_name
+        self._norms = np.concatenate(
+            [
+                np.square(quantizer.decode(codes[i : i + _BLOCK_ROWS])).sum(axis=1)
+                for i in range(0, len(codes), _BLOCK_ROWS)
+            ]
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the codes a search scans."""
+        return int(self.codes.nbytes)
+
+    @property
+    def disk_nbytes(self) -> int:
+        """Size of everything `save` writes (codes, ids and quantizer), uncompressed."""
+        q = self.quantizer
+        extra = [a for a in (q.components, q.scale) if a is not None]
+        return int(self.codes.nbytes + self.ids.nbytes + q.mean.nbytes + sum(a.nbytes for a in extra))
+
+    def approx_distances(self, vector: np.ndarray) -> np.ndarray:
+        """Squared L2 from the query to every decoded code, up to a constant."""
+        query = self.quantizer.project(vector[None])[0]
+        if self.quantizer.scale is not None:
+            # Fold the int8 step into the query instead of decoding every block.
+            query = query * self.quantizer.scale
+        dots = np.concatenate(
+            [
+                self.codes[i : i + _BLOCK_ROWS].astype(np.float32) @ query
+                for i in range(0, len(self.codes), _BLOCK_ROWS)
+            ]
+        )
+        return self._norms - 2.0 * dots
+
+    def positions(self, table, where: str) -> np.ndarray:
+        matching = table.to_lance().to_table(columns=["id"], filter=where).column("id").to_numpy(zero_copy_only=False)
+        found = pd.Index(self.ids).get_indexer(matching)
+        return found[found >= 0]
+
+    def search(
+        self,
+        table,
+        vector: list[float],
+        k: int,
+        rescore: Optional[int] = None,
+        where: Optional[str] = None,
+        columns: Optional[list[str]] = None,
+    ) -> list[dict]:
+        """k nearest rows: top k * rescore by code distance, re-ranked on float32 vectors."""
+        vector = np.asarray(vector, dtype=np.float32)
+        approx = self.approx_distances(vector)
+        if where:
+            allowed = self.positions(table, where)
+            masked = np.full_like(approx, np.inf)
+            masked[allowed] = approx[allowed]
+            approx = masked
+        candidates = min(k * (rescore or config.VECTOR_COMPACT_RESCORE), int(np.isfinite(approx).sum()))
+        if candidates == 0:
+            return []
+        picked = np.sort(np.argpartition(approx, candidates - 1)[:candidates])
+        if columns is None:
+            columns = [name for name in table.schema.names if name != VECTOR_COLUMN]
+        rows = table.to_lance().take(picked, columns=[*columns, VECTOR_COLUMN])
+        full = np.stack(rows.column(VECTOR_COLUMN).to_numpy(zero_copy_only=False)).astype(np.float32)
+        exact = np.square(full - vector).sum(axis=1)
+        records = rows.drop_columns([VECTOR_COLUMN]).to_pylist()
+        best = np.argsort(exact, kind="stable")[:k]
+        return [{**records[i], "_distance": float(exact[i])} for i in best]
+
+    def save(self, path: Path) -> None:
+        q = self.quantizer
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            path,
+            codes=self.codes,
+            ids=self.ids,
+            mean=q.mean,
+            components=q.components if q.components is not None else np.zeros((0, 0), np.float32),
+            scale=q.scale if q.scale is not None else np.zeros(0, np.float32),
+            dtype=np.asarray(q.dtype),
+            version=np.asarray(self.version),
+            table_name=np.asarray(self.table_name),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "CompactVectorIndex":
+        with np.load(path, allow_pickle=False) as f:
+            quantizer = VectorQuantizer(
+                str(f["dtype"]),
+                f["mean"],
+                f["components"] if f["components"].size else None,
+                f["scale"] if f["scale"].size else None,
+            )
+            return cls(quantizer, f["codes"], f["ids"], int(f["version"]), str(f["table_name"]))
+
+
+def _path(table_name: str) -> Path:
+    return Path(config.VECTOR_COMPACT_DIR) / f"{table_name}.npz"
+
+
+def build_compact_index(
+    table_name: str = "policy_docs",
+    dtype: Optional[str] = None,
+    pca_dims: Optional[int] = None,
+    save: bool = True,
+) -> CompactVectorIndex:
+    """Quantize the table's vector column (defaults from VECTOR_COMPACT_*)."""
+    table = open_table(table_name)
+    dataset = table.to_lance()
+    if dataset.count_rows() == 0:
+        raise ValueError(f"LanceDB table '{table_name}' is empty.")
+    dtype = dtype or config.VECTOR_COMPACT_DTYPE
+    pca_dims = config.VECTOR_COMPACT_PCA_DIMS if pca_dims is None else pca_dims
+    sample = dataset.sample(min(_FIT_SAMPLE, dataset.count_rows()), columns=[VECTOR_COLUMN])
+    quantizer = VectorQuantizer.fit(
+        np.stack(sample.column(VECTOR_COLUMN).to_numpy(zero_copy_only=False)), dtype, pca_dims
+    )
+    codes, ids = [], []
+    for batch in dataset.to_batches(columns=["id", VECTOR_COLUMN]):
+        vectors = batch.column(VECTOR_COLUMN).flatten().to_numpy().reshape(batch.num_rows, -1)
+        codes.append(quantizer.encode(vectors))
+        ids.append(batch.column("id").to_numpy(zero_copy_only=False).astype(str))
+    index = CompactVectorIndex(quantizer, np.concatenate(codes), np.concatenate(ids), table.version, table_name)
+    if save:
+        index.save(_path(table_name))
+        _loaded[table_name] = index
+    return index
+
+
+def load_compact_index(table) -> Optional[CompactVectorIndex]:
+    """The saved index for `table` if it matches the table's current version."""
+    index = _loaded.get(table.name)
+    if index is None or index.version != table.version:
+        path = _path(table.name)
+        if not path.exists():
+            return None
+        index = _loaded[table.name] = CompactVectorIndex.load(path)
+    return index if index.version == table.version else None
+
+
+def ensure_compact_index(table_name: str = "policy_docs") -> Optional[dict]:
+    """Rebuild the compact index if enabled and stale; returns what was done."""
+    if config.VECTOR_COMPACT_DTYPE == "none":
+        return None
+    table = open_table(table_name)
+    if load_compact_index(table) is not None:
+        return {"table": table_name, "action": "none"}
+    start = time.perf_counter()
+    index = build_compact_index(table_name)
+    return {
+        "table": table_name,
+        "action": "compacted",
+        "dtype": index.quantizer.dtype,
+        "dims": index.quantizer.dims,
+        "scan_bytes": index.nbytes,
+        # On top of the float32 vectors, which stay in the table.
+        "added_disk_bytes": _path(table_name).stat().st_size,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def compact_search(
+    table,
+    vector: list[float],
+    k: int,
+    where: Optional[str] = None,
+    columns: Optional[list[str]] = None,
+) -> Optional[list[dict]]:
+    """Search through the compact index, or None when there is no current one."""
+    index = load_compact_index(table)
+    if index is None:
+        return None
+    return index.search(table, vector, k, where=where, columns=columns)
+
+
+def benchmark_quantization(
+    table_name: str = "policy_docs",
+    settings: tuple[tuple[str, int], ...] = (("float16", 0), ("int8", 0), ("int8", 256), ("float16", 256)),
+    queries: int = 50,
+    k: int = 10,
+    rescore: tuple[int, ...] = (1, 4),
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Footprint, mean latency and recall@k of each (dtype, pca_dims, rescore) vs exact float32.
+
+    Query vectors are sampled from the table; the float32 row is the exact
+    LanceDB search with any ANN index bypassed. Nothing is saved.
+    `scan_bytes`/`scan_ratio` are what a search reads in memory; `disk_bytes`
+    is the real on-disk footprint, i.e. the float32 column (kept for
+    rescoring) plus the compact index, so `disk_vs_float32` is above 1.
+    """
+    table = open_table(table_name)
+    dataset = table.to_lance()
+    rows = dataset.count_rows()
+    dims = table.schema.field(VECTOR_COLUMN).type.list_size
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(rows, size=min(queries, rows), replace=False))
+    vectors = np.stack(dataset.take(picked, columns=[VECTOR_COLUMN]).column(VECTOR_COLUMN).to_numpy(zero_copy_only=False))
+
+    truth, exact_ms = [], []
+    for v in vectors:
+        start = time.perf_counter()
+        found = table.search(v).limit(k).bypass_vector_index().select(["id"]).to_list()
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        truth.append({row["id"] for row in found})
+    float32_bytes = rows * dims * 4
+    report = [
+        {
+            "dtype": "float32",
+            "pca_dims": 0,
+            "rescore": None,
+            "scan_bytes": float32_bytes,
+            "scan_ratio": 1.0,
+            "disk_bytes": float32_bytes,
+            "disk_vs_float32": 1.0,
+            "recall_at_k": 1.0,
+            "mean_ms": float(np.mean(exact_ms)),
+        }
+    ]
+    for dtype, pca_dims in settings:
+        if pca_dims >= dims:
+            continue
+        index = build_compact_index(table_name, dtype, pca_dims, save=False)
+        for factor in rescore:
+            recalls, latencies = [], []
+            for v, expected in zip(vectors, truth):
+                start = time.perf_counter()
+                found = index.search(table, v, k, rescore=factor, columns=["id"])
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len({row["id"] for row in found} & expected) / max(len(expected), 1))
+            report.append(
+                {
+                    "dtype": dtype,
+                    "pca_dims": pca_dims,
+                    "rescore": factor,
+                    "scan_bytes": index.nbytes,
+                    "scan_ratio": round(float32_bytes / index.nbytes, 1),
+                    "disk_bytes": float32_bytes + index.disk_nbytes,
+                    "disk_vs_float32": round((float32_bytes + index.disk_nbytes) / float32_bytes, 2),
+                    "recall_at_k": float(np.mean(recalls)),
+                    "mean_ms": float(np.mean(latencies)),
+                }
+            )
+    return pd.DataFrame(report)
@@ -2,18 +2,29 @@ import lancedb
 import streamlit as st
 
 from core import config
+from core.rag.embedding_cache import cache_stats
 from core.rag.generator import GeneratorFactory, PromptPiece
 from core.rag.text_retriever import TextRetriever
 from core.ui.sidebar import render_sidebar_settings
 
 
-def build_text_rag_answer(query: str, provider: str, k: int):
+def build_text_rag_answer(
+    query: str,
+    provider: str,
+    k: int,
+    state: str = None,
+    year: int = None,
+    mode: str = None,
+    vector_weight: float = None,
+):
     db = lancedb.connect(str(config.LANCE_DB_PATH))
     if "policy_docs" not in db.table_names():
         raise RuntimeError("LanceDB table 'policy_docs' not found. Run ingestion first.")
 
     retriever = TextRetriever(provider)
-    results = retriever.search(query, k=k)
+    results = retriever.search(
+        query, k=k, state=state, year=year, mode=mode, vector_weight=vector_weight
+    )
     if not results:
         return "No relevant chunks found.", []
 
@@ -43,7 +54,21 @@ provider_choice, openai_key = render_sidebar_settings()
 
 st.subheader("Ask a Question")
 query = st.text_area("Question", height=120)
-top_k = st.slider("Top-K", min_value=2, max_value=10, value=5)
+# Hybrid ranking puts exact matches (waiver numbers, citations) next to
+# semantic ones, so fewer chunks are needed than with vector-only search.
+top_k = st.slider("Top-K", min_value=2, max_value=10, value=4)
+col_mode, col_weight = st.columns(2)
+modes = ["hybrid", "vector", "fts"]
+search_mode = col_mode.selectbox(
+    "Retrieval", modes, index=modes.index(config.TEXT_SEARCH_MODE) if config.TEXT_SEARCH_MODE in modes else 0
+)
+vector_weight = col_weight.slider(
+    "Vector weight (hybrid)", 0.0, 1.0, config.TEXT_HYBRID_VECTOR_WEIGHT, 0.05,
+    disabled=search_mode != "hybrid",
+)
+col_state, col_year = st.columns(2)
+state_filter = col_state.selectbox("State", ["All states", *[name for _, name in config.US_STATES]])
+year_filter = col_year.number_input("Approval year (0 = any)", min_value=0, max_value=2100, value=0, step=1)
 
 if st.button("Run Text RAG"):
     if not query.strip():
@@ -54,10 +79,23 @@ if st.button("Run Text RAG"):
             st.stop()
         with st.spinner("Running Text RAG..."):
             try:
-                answer, sources = build_text_rag_answer(query, provider_choice, top_k)
+                answer, sources = build_text_rag_answer(
+                    query,
+                    provider_choice,
+                    top_k,
+                    state=None if state_filter == "All states" else state_filter,
+                    year=int(year_filter) or None,
+                    mode=search_mode,
+                    vector_weight=vector_weight,
+                )
                 st.markdown("### Answer")
                 st.write(answer)
                 st.markdown("### Sources")
                 st.json(sources)
+                stats = cache_stats()
+                st.caption(
+                    f"Query embedding cache: {stats['hits'] + stats['disk_hits']} hits, "
+                    f"{stats['misses']} misses (hit rate {stats['hit_rate']})."
+                )
             except Exception as exc:
                 st.error(f"Text RAG failed: {exc}")
@@ -1,9 +1,25 @@
 import streamlit as st
 
+from core.rag.embedding_cache import cache_stats
 from core.rag.pipeline import GraphRAGPipeline
+from core.storage import graph_matrix
 from core.ui.sidebar import render_sidebar_settings
 
 
+def render_plan_summary(plan: dict) -> None:
+    summary = plan.get("plan_summary") or {}
+    if not summary:
+        return
+    with st.expander("Query plan (EXPLAIN)", expanded=not plan.get("is_safe", True)):
+        st.code(plan.get("cypher_query", ""), language="cypher")
+        c1, c2 = st.columns(2)
+        c1.metric("Estimated result rows", f"{summary.get('estimated_rows', 0):,.0f}")
+        c2.metric("Largest operator estimate", f"{summary.get('max_estimated_rows', 0):,.0f}")
+        if summary.get("rewritten"):
+            st.info(f"Query rewritten: {summary['rewritten']}")
+        st.dataframe(summary.get("operators", []), use_container_width=True)
+
+
 st.set_page_config(page_title="Graph RAG", layout="wide")
 st.title("Graph RAG")
 
@@ -23,13 +39,65 @@ if st.button("Run Graph RAG"):
             try:
                 pipe = GraphRAGPipeline()
                 plan = pipe.plan(query)
+                render_plan_summary(plan)
                 if not plan.get("is_safe", True):
                     st.error(f"Graph plan rejected: {plan.get('error')}")
                 else:
-                    result = pipe.execute(plan.get("cypher_query", ""), query)
+                    if plan.get("template"):
+                        st.caption(f"Answered with the `{plan['template']}` query template.")
+                    elif plan.get("cache_hit"):
+                        st.caption("Reused a cached query plan.")
+                    result = pipe.execute(
+                        plan.get("cypher_query", ""),
+                        query,
+                        plan.get("cypher_params"),
+                        question_vector=plan.get("question_vector"),
+                        prefetched_graph=plan.get("prefetched_graph"),
+                        filters=plan.get("filters"),
+                        template=plan.get("template"),
+                    )
                     st.markdown("### Answer")
                     st.write(result.get("answer"))
                     st.markdown("### Graph Data")
                     st.json(result.get("graph_data"))
+                    with st.expander("Latency per node (ms)"):
+                        st.json({**plan.get("timings", {}), **result.get("timings", {})})
+                        st.caption(f"Query embedding cache: {cache_stats()}")
             except Exception as exc:
                 st.error(f"Graph RAG failed: {exc}")
+
+st.divider()
+st.subheader("Graph Analytics")
+st.caption("Computed in-process on a cached sparse copy of the waiver graph.")
+if st.button("Load graph analytics"):
+    try:
+        gm = graph_matrix.load_graph_matrix()
+    except Exception as exc:
+        st.error(f"Could not load the graph: {exc}")
+        st.stop()
+    st.session_state["graph_matrix"] = gm
+
+gm = st.session_state.get("graph_matrix")
+if gm is not None:
+    c1, c2, c3 = st.columns(3)
+    c1.metric("States", len(gm.states))
+    c2.metric("Waivers", len(gm.waiver_ids))
+    c3.metric("Distinct answers", len(gm.theme_keys))
+
+    state_filter = st.selectbox("Co-occurrence within state", ["All states", *gm.states.tolist()])
+    st.markdown("#### Answers most often given together")
+    st.dataframe(
+        graph_matrix.top_cooccurring(gm, None if state_filter == "All states" else state_filter),
+        use_container_width=True,
+    )
+
+    st.markdown("#### Answers that distinguish amendments from new applications")
+    st.dataframe(
+        graph_matrix.theme_prevalence_difference(
+            gm, gm.waiver_mask(app_type="AMENDMENT"), gm.waiver_mask(app_type="NEW")
+        ).rename(columns={"share_a": "amendments", "share_b": "new"}),
+        use_container_width=True,
+    )
+
+    st.markdown("#### Most central nodes (PageRank)")
+    st.dataframe(graph_matrix.pagerank(gm).head(25), use_container_width=True)
@@ -0,0 +1,31 @@
+from core import config
+from core.rag.plan_cache import PlanCache, has_literals
+
+VECTOR_PLAN = {
+    "cypher_query": (
+        'CALL db.index.vector.queryNodes("waiver_embeddings", 10, $vector) YIELD node AS w, score '
+        "RETURN w.waiver_id AS waiver_id, w.title AS title, score"
+    ),
+    "cypher_params": {"k": 10},
+    "filters": {},
+    "execution_plan": "vector search",
+    "plan_summary": "waivers about home care",
+}
+
+
+def test_procedure_arguments_are_not_literals():
+    assert not has_literals(VECTOR_PLAN)
+    assert has_literals({"cypher_query": "MATCH (s:State {name: 'Ohio'}) RETURN s"})
+    assert has_literals({"cypher_query": "MATCH (w) WHERE toLower(w.state) CONTAINS 'ohio' RETURN w"})
+
+
+def test_vector_plan_reused_for_near_duplicate_question(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SQLITE_PATH", tmp_path / "app.db")
+    cache = PlanCache(similarity_threshold=0.95)
+    cache.store("Which waivers cover home care?", VECTOR_PLAN, [1.0, 0.0, 0.1])
+
+    plan = cache.lookup("Which waivers cover home-care services?", [0.99, 0.01, 0.1])
+
+    assert plan is not None
+    assert plan["cypher_query"] == VECTOR_PLAN["cypher_query"]
+    assert cache.lookup("Unrelated question", [0.0, 1.0, 0.0]) is None
@@ -1,7 +1,19 @@
 import streamlit as st
 
+from core.storage.graph_schema import ensure_graph_schema
+
+
+@st.cache_resource(show_spinner=False)
+def _bootstrap_graph_schema() -> dict:
+    # Neo4j is optional for most pages, so a missing server must not block startup.
+    try:
+        return ensure_graph_schema()
+    except Exception as exc:
+        return {"error": str(exc)}
+
 
 st.set_page_config(page_title="Policy Analysis", layout="wide")
+_bootstrap_graph_schema()
 
 st.title("Policy Analysis & Extraction")
 st.caption("Use the pages on the left to upload documents and run RAG workflows.")